@@ -8,6 +8,14 @@ if os.path.isfile(requirementPath):
     with open(requirementPath) as f:
         install_requires = f.read().splitlines()
 
+# optional dependencies of datasources, e.g. pip install twiddlepy[arrow]
+extras_require = {
+    'arrow': ['pyarrow'],
+    'excel': ['openpyxl'],
+    'zstd': ['zstandard'],
+    'isal': ['isal'],
+}
+
 with open("README.md", "r") as fh:
     long_description = fh.read()
 
@@ -22,6 +30,7 @@ setup(
     url="https://github.com/mediaintegration/twiddlepy",
     packages=find_packages(exclude=["tests", "scripts"]),
     install_requires=install_requires,
+    extras_require=extras_require,
     include_package_data=True,
     entry_points = {
         'console_scripts': ['twiddle=twiddle.command_line:main'],
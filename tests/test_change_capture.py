@@ -0,0 +1,98 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import configparser
+
+import pandas as pd
+
+from twiddlepy.config import config as default_config
+from twiddlepy.datasources.ds_sql import DsDatabaseSqlite
+
+
+'''
+    Round trip of trigger based change capture on a Sqlite table: the first
+    read is a full read, then inserts, updates (incl. of the key) and deletes
+    are read from the changelog.
+'''
+class TestSqliteChangeCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'source.db')
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+        conn.executemany('INSERT INTO items VALUES (?, ?)', [(1, 'a'), (2, 'b'), (4, 'd')])
+        conn.commit()
+        conn.close()
+
+        config = configparser.ConfigParser()
+        config.read_dict(default_config)
+        ds_config = config['DsDatabaseSqlite']
+        ds_config['DbPath'] = self.db_path
+        ds_config['ChangeCapture'] = 'True'
+        ds_config['WatermarkStore'] = os.path.join(self.tmpdir, 'watermarks.db')
+        ds_config['ResetWatermark'] = 'False'
+        self.ds = DsDatabaseSqlite(config)
+
+    def tearDown(self):
+        self.ds.close()
+        shutil.rmtree(self.tmpdir)
+
+    def execute(self, *statements):
+        conn = sqlite3.connect(self.db_path)
+        for stmt in statements:
+            conn.execute(stmt)
+        conn.commit()
+        conn.close()
+
+    '''
+        Function that reads the table as the driver does
+
+        Returns:
+            (sorted ids read, sorted ids deleted)
+    '''
+    def read(self):
+        dfs = self.ds.read_data_to_df('items', dtype='str')
+        if isinstance(dfs, pd.DataFrame):
+            dfs = [dfs]
+        ids = sorted(int(i) for df in dfs for i in df['ID'])
+
+        deleted = self.ds.get_deleted_rows('items')
+        deleted_ids = sorted(int(i) for i in deleted['ID']) if deleted is not None else []
+
+        self.ds.archive_data('items')
+        return ids, deleted_ids
+
+    def test_round_trip(self):
+        self.assertEqual(self.read(), ([1, 2, 4], []))
+
+        self.execute("INSERT INTO items VALUES (3, 'c')",
+                     "UPDATE items SET name = 'A' WHERE id = 1",
+                     "DELETE FROM items WHERE id = 2",
+                     "UPDATE items SET id = 5 WHERE id = 4")
+        self.assertEqual(self.read(), ([1, 3, 5], [2, 4]))
+
+        # deleted and inserted again is not deleted
+        self.execute("DELETE FROM items WHERE id = 3",
+                     "INSERT INTO items VALUES (3, 'c')")
+        self.assertEqual(self.read(), ([3], []))
+
+        # changes read are removed from the changelog
+        self.assertEqual(self.read(), ([], []))
+
+    def test_reinstall_triggers(self):
+        self.read()
+        # a partial install is completed
+        self.execute('DROP TRIGGER twiddle_items_delete')
+        self.ds.captured_tables.clear()
+        self.read()
+
+        self.execute("DELETE FROM items WHERE id = 1")
+        self.assertEqual(self.read(), ([], [1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
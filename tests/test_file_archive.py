@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+import configparser
+
+from twiddlepy.config import config as default_config
+from twiddlepy.datasources.ds_file import DsFileCsv
+
+
+'''
+    Background archiving of processed files, with retries of failed archives
+'''
+class TestBackgroundArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'source')
+        self.archive = os.path.join(self.tmpdir, 'archive')
+        self.fail_location = os.path.join(self.tmpdir, 'fail')
+        os.makedirs(self.source)
+        with open(os.path.join(self.source, 'a.csv'), 'w') as f:
+            f.write('id\n1\n')
+        os.utime(os.path.join(self.source, 'a.csv'), (0, 0))
+
+        config = configparser.ConfigParser()
+        config.read_dict(default_config)
+        ds_config = config['DsFileCsv']
+        ds_config['SourceLocation'] = self.source
+        ds_config['ArchiveLocation'] = self.archive
+        ds_config['FailLocation'] = self.fail_location
+        ds_config['ColumnSeparator'] = "','"
+        ds_config['ArchiveWorkers'] = '1'
+        ds_config['ArchiveRetries'] = '2'
+        self.ds = DsFileCsv(config)
+
+        # archive attempts by archive label, failing while the label is in self.failing
+        self.attempts = []
+        self.failing = set()
+        archive_file = self.ds.archive_file
+
+        def failing_archive_file(source_path, archive_path, archive_label):
+            self.attempts.append(archive_label)
+            if archive_label in self.failing:
+                raise OSError('disk full')
+            archive_file(source_path, archive_path, archive_label)
+
+        self.ds.archive_file = failing_archive_file
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_retry(self):
+        self.failing.add('Archive')
+        self.ds.archive_data('a.csv')
+        self.ds.close()
+        self.assertEqual(self.attempts, ['Archive']*3 + ['Fail'])
+        self.assertTrue(os.path.exists(os.path.join(self.fail_location, 'a.csv')))
+        self.assertEqual(self.ds.get_data_units(), [])
+
+    def test_fail_location_fails(self):
+        self.failing.update(['Archive', 'Fail'])
+        self.ds.archive_data('a.csv')
+        self.ds.close()
+        self.assertEqual(self.attempts, ['Archive']*3 + ['Fail']*3)
+        # left in place, but not read again
+        self.assertTrue(os.path.exists(os.path.join(self.source, 'a.csv')))
+        self.assertEqual(self.ds.get_data_units(), [])
+
+    def test_archive(self):
+        self.ds.archive_data('a.csv')
+        self.ds.close()
+        self.assertEqual(self.attempts, ['Archive'])
+        self.assertTrue(os.path.exists(os.path.join(self.archive, 'a.csv')))
+
+
+if __name__ == '__main__':
+    unittest.main()
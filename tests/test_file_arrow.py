@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+import configparser
+
+import pandas as pd
+
+from twiddlepy.config import config as default_config
+from twiddlepy.datasources.ds_file import DsFileParquet, has_pyarrow
+from twiddlepy.flatten import FlattenPlan
+
+if has_pyarrow:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+
+'''
+    Parquet files with nested columns, read as text as the driver does
+'''
+@unittest.skipUnless(has_pyarrow, 'pyarrow is not installed')
+class TestParquetNested(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        table = pa.table({'id': [1, 2],
+                          'address': [{'city': 'London', 'zip': 1}, None],
+                          'tags': [['a', 'b'], []],
+                          'price': [1.5, None]})
+        pq.write_table(table, os.path.join(self.tmpdir, 'items.parquet'))
+
+        config = configparser.ConfigParser()
+        config.read_dict(default_config)
+        config['DsFileParquet']['SourceLocation'] = self.tmpdir
+        self.ds = DsFileParquet(config)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_nested_columns(self):
+        df = next(self.ds.read_data_to_df('items.parquet', dtype='str'))
+        self.assertEqual(list(df.columns), ['id', 'address', 'tags', 'price', 'filename'])
+        self.assertEqual(list(df['id']), ['1', '2'])
+        self.assertEqual(df['price'][0], '1.5')
+        self.assertTrue(pd.isnull(df['price'][1]))
+        self.assertEqual(list(df['address']), [{'city': 'London', 'zip': 1}, None])
+        self.assertEqual(list(df['tags']), [['a', 'b'], []])
+
+        df = FlattenPlan(['id', 'address.city', 'tags[0]']).apply(df)
+        self.assertEqual(list(df['address.city']), ['London', None])
+        self.assertEqual(list(df['tags[0]']), ['a', None])
+
+    def test_project_nested_roots(self):
+        self.ds.set_mapper(SourceFields(['id', 'address.city']))
+        df = next(self.ds.read_data_to_df('items.parquet', dtype='str'))
+        self.assertEqual(list(df.columns), ['id', 'address', 'filename'])
+
+
+'''
+    Mapper of a list of source field names
+'''
+class SourceFields:
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def get_source_field_names(self, dataset=None):
+        return self.fields
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import gzip
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+import configparser
+
+from twiddlepy.config import config as default_config
+from twiddlepy.datasources.ds_file import DsFileCsv
+
+
+'''
+    Round trip of CSV members of zip and tar containers: members are listed
+    and read as data units, and the container is archived once every member
+    is processed, or moved to the fail location if one failed.
+'''
+class TestCsvContainer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'source')
+        self.archive = os.path.join(self.tmpdir, 'archive')
+        self.fail_location = os.path.join(self.tmpdir, 'fail')
+        os.makedirs(self.source)
+
+        config = configparser.ConfigParser()
+        config.read_dict(default_config)
+        ds_config = config['DsFileCsv']
+        ds_config['SourceLocation'] = self.source
+        ds_config['ArchiveLocation'] = self.archive
+        ds_config['FailLocation'] = self.fail_location
+        ds_config['ColumnSeparator'] = "','"
+        ds_config['FilePattern'] = '*.csv*'
+        ds_config['ContainerPattern'] = '*.zip *.tar.gz'
+        self.ds = DsFileCsv(config)
+
+    def tearDown(self):
+        self.ds.close()
+        shutil.rmtree(self.tmpdir)
+
+    '''
+        Function that writes a container of CSV members, aged so it is listed
+
+        Params:
+            name: container file name
+            members: dict of member name and CSV text
+    '''
+    def write_container(self, name, members):
+        path = os.path.join(self.source, name)
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                for member, text in members.items():
+                    zf.writestr(member, gzip.compress(text.encode()) if member.endswith('.gz') else text)
+        else:
+            member_dir = os.path.join(self.tmpdir, 'members')
+            os.makedirs(member_dir, exist_ok=True)
+            with tarfile.open(path, 'w:gz') as tf:
+                for member, text in members.items():
+                    with open(os.path.join(member_dir, member), 'w') as f:
+                        f.write(text)
+                    tf.add(os.path.join(member_dir, member), arcname=member)
+        os.utime(path, (0, 0))
+
+    '''
+        Function that reads every data unit as the driver does
+
+        Returns:
+            dict of (id, name) rows keyed on data unit
+    '''
+    def read_units(self):
+        rows = {}
+        for unit in self.ds.get_data_units():
+            df = self.ds.read_data_to_df(unit, dtype='str')
+            rows[unit] = sorted(zip(df['id'], df['name']))
+            self.assertTrue((df['filename'] == os.path.basename(unit.split('::')[-1])).all())
+            self.ds.archive_data(unit)
+        return rows
+
+    def test_zip_round_trip(self):
+        self.write_container('c.zip', {'m1.csv': 'id,name\n1,a\n2,b\n', 'm2.csv.gz': 'id,name\n3,c\n', 'notes.txt': 'x'})
+        self.assertEqual(self.read_units(), {'c.zip::m1.csv': [('1', 'a'), ('2', 'b')],
+                                             'c.zip::m2.csv.gz': [('3', 'c')]})
+        self.assertTrue(os.path.exists(os.path.join(self.archive, 'c.zip')))
+        self.assertFalse(os.path.exists(os.path.join(self.source, 'c.zip')))
+        self.assertEqual(self.read_units(), {})
+
+    def test_tar_round_trip(self):
+        self.write_container('c.tar.gz', {'m1.csv': 'id,name\n1,a\n'})
+        self.assertEqual(self.read_units(), {'c.tar.gz::m1.csv': [('1', 'a')]})
+        self.assertTrue(os.path.exists(os.path.join(self.archive, 'c.tar.gz')))
+
+    def test_failed_member(self):
+        self.write_container('c.zip', {'m1.csv': 'id,name\n1,a\n', 'm2.csv': 'id,name\n2,b\n'})
+        units = self.ds.get_data_units()
+        self.ds.archive_data(units[0], done=False)
+        self.ds.archive_data(units[1])
+        self.assertTrue(os.path.exists(os.path.join(self.fail_location, 'c.zip')))
+
+    def test_empty_container(self):
+        self.write_container('c.zip', {'notes.txt': 'x'})
+        self.assertEqual(self.ds.get_data_units(), [])
+        self.assertTrue(os.path.exists(os.path.join(self.fail_location, 'c.zip')))
+
+
+if __name__ == '__main__':
+    unittest.main()
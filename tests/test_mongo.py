@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+import unittest
+import configparser
+
+import pandas as pd
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from pymongo.write_concern import WriteConcern
+
+from twiddlepy.config import config as default_config
+from twiddlepy.datasources.ds_mongo import DsMongo
+
+# server of the tests
+mongo_host = os.environ.get('MONGO_HOST', 'localhost')
+mongo_port = int(os.environ.get('MONGO_PORT', '27017'))
+mongo_database = 'twiddlepy_test'
+
+
+'''
+    Function to connect to the mongod of the tests
+
+    Returns:
+        (client, if the server is a replica set member), client None if no server is available
+'''
+def connect():
+    client = MongoClient(mongo_host, mongo_port, serverSelectionTimeoutMS=3000)
+    try:
+        hello = client.admin.command('isMaster')
+    except PyMongoError:
+        client.close()
+        return None, False
+    return client, 'setName' in hello
+
+
+'''
+    Reads of a local mongod, skipped if there is none. Change streams are
+    only tested on a replica set, e.g. mongod --replSet rs0 initiated with
+    rs.initiate().
+'''
+class TestMongo(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client, cls.replica_set = connect()
+        if cls.client is None:
+            raise unittest.SkipTest('No mongod at {}:{}'.format(mongo_host, mongo_port))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.drop_database(mongo_database)
+        cls.client.close()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # majority writes are visible to change streams once acknowledged
+        self.collection = self.client[mongo_database].get_collection('items', write_concern=WriteConcern('majority'))
+        self.collection.drop()
+        self.insert(range(9))
+
+    def tearDown(self):
+        self.collection.drop()
+        shutil.rmtree(self.tmpdir)
+
+    def insert(self, ids):
+        self.collection.insert_many([{'_id': i, 'ts': i // 3, 'name': str(i)} for i in ids])
+
+    def get_datasource(self, **options):
+        config = configparser.ConfigParser()
+        config.read_dict(default_config)
+        ds_config = config['DsMongo']
+        ds_config['MongoServer'] = mongo_host
+        ds_config['MongoPort'] = str(mongo_port)
+        ds_config['MongoDatabase'] = mongo_database
+        ds_config['MongoCollection'] = 'items'
+        ds_config['WatermarkStore'] = os.path.join(self.tmpdir, 'watermarks.db')
+        ds_config['ResetWatermark'] = 'False'
+        for key, value in options.items():
+            ds_config[key] = value
+        return DsMongo(config)
+
+    '''
+        Function that reads the collection as the driver does
+
+        Params:
+            ds: datasource
+            fail_after: number of chunks read before the read fails, None to read all
+
+        Returns:
+            (sorted ids read, sorted ids deleted)
+    '''
+    def read(self, ds, fail_after=None):
+        dfs = ds.read_data_to_df('items', dtype='str')
+        if isinstance(dfs, pd.DataFrame):
+            dfs = [dfs]
+        ids = []
+        for n, df in enumerate(dfs):
+            if n == fail_after:
+                dfs.close()
+                ds.archive_data('items', done=False)
+                return sorted(ids), []
+            ids.extend(int(i) for i in df['_id'])
+
+        deleted = ds.get_deleted_rows('items')
+        deleted_ids = sorted(int(i) for i in deleted['_id']) if deleted is not None else []
+
+        ds.archive_data('items')
+        return sorted(ids), deleted_ids
+
+    def test_incremental_reads(self):
+        ds = self.get_datasource(WatermarkField='_id', ChunkSize='2')
+        self.assertEqual(self.read(ds), (list(range(9)), []))
+        self.insert(range(9, 12))
+        self.assertEqual(self.read(ds), ([9, 10, 11], []))
+        self.assertEqual(self.read(ds), ([], []))
+        ds.close()
+
+    def test_non_unique_watermark_restart(self):
+        # a restart after a failed chunk reads the whole collection again
+        ds = self.get_datasource(WatermarkField='ts', ChunkSize='2')
+        ids, _ = self.read(ds, fail_after=2)
+        self.assertEqual(len(ids), 4)
+        ds.close()
+
+        ds = self.get_datasource(WatermarkField='ts', ChunkSize='2')
+        self.assertEqual(self.read(ds), (list(range(9)), []))
+        self.insert(range(9, 12))
+        self.assertEqual(self.read(ds), ([9, 10, 11], []))
+        ds.close()
+
+    def test_change_stream(self):
+        if not self.replica_set:
+            self.skipTest('Change streams require a replica set')
+
+        ds = self.get_datasource(ChangeStream='True')
+        self.assertEqual(self.read(ds), (list(range(9)), []))
+        self.assertIsNotNone(ds.watermarks.get(ds.resume_token_key))
+
+        self.insert([9])
+        self.collection.update_one({'_id': 1}, {'$set': {'name': 'one'}})
+        self.collection.delete_one({'_id': 2})
+        # deleted and inserted again is not deleted
+        self.collection.delete_one({'_id': 3})
+        self.insert([3])
+        self.assertEqual(self.read(ds), ([1, 3, 9], [2]))
+        self.assertEqual(self.read(ds), ([], []))
+        ds.close()
+
+        # the resume token is persisted
+        self.collection.delete_one({'_id': 4})
+        ds = self.get_datasource(ChangeStream='True')
+        self.assertEqual(self.read(ds), ([], [4]))
+        ds.close()
+
+    def test_change_stream_failed_read(self):
+        if not self.replica_set:
+            self.skipTest('Change streams require a replica set')
+
+        ds = self.get_datasource(ChangeStream='True')
+        self.read(ds)
+
+        # changes of a failed read are read again
+        self.insert([9])
+        dfs = ds.read_data_to_df('items', dtype='str')
+        self.assertEqual([int(i) for df in dfs for i in df['_id']], [9])
+        ds.archive_data('items', done=False)
+        self.assertEqual(self.read(ds), ([9], []))
+        ds.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
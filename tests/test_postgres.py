@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+import configparser
+from decimal import Decimal
+
+import pandas as pd
+
+from twiddlepy.config import config as default_config
+from twiddlepy.datasources.ds_sql import DsDatabasePostgres, has_psycopg2
+
+if has_psycopg2:
+    import psycopg2
+
+# server of the tests, set with the libpq environment variables
+pg_server = {'host': os.environ.get('PGHOST', 'localhost'), 'port': os.environ.get('PGPORT', '5432'),
+             'dbname': os.environ.get('PGDATABASE', 'postgres'), 'user': os.environ.get('PGUSER', 'postgres'),
+             'password': os.environ.get('PGPASSWORD', '')}
+
+
+'''
+    Function to connect to the Postgres server of the tests
+
+    Returns:
+        psycopg2 connection, None if no server is available
+'''
+def connect():
+    if not has_psycopg2:
+        return None
+    try:
+        return psycopg2.connect(connect_timeout=3, **pg_server)
+    except psycopg2.Error:
+        return None
+
+
+'''
+    COPY exports of a local Postgres server, skipped if there is none
+'''
+class TestPostgresCopy(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = connect()
+        if cls.conn is None:
+            raise unittest.SkipTest('No Postgres server at {host}:{port}'.format(**pg_server))
+        cls.conn.autocommit = True
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.execute('DROP TABLE IF EXISTS "Twiddle Items"',
+                     '''CREATE TABLE "Twiddle Items" (id integer PRIMARY KEY, code text, big bigint, n integer,
+                            price numeric(10, 2), ratio double precision, flag boolean, ts timestamp, note text)''')
+        self.insert(range(1, 6))
+        self.execute('''UPDATE "Twiddle Items" SET code = '00123', big = 9007199254740993, n = NULL,
+                            price = 1.50, flag = TRUE, note = '' WHERE id = 1''')
+
+    def tearDown(self):
+        self.execute('DROP TABLE IF EXISTS "Twiddle Items"')
+        shutil.rmtree(self.tmpdir)
+
+    def execute(self, *statements):
+        with self.conn.cursor() as cursor:
+            for stmt in statements:
+                cursor.execute(stmt)
+
+    def insert(self, ids):
+        with self.conn.cursor() as cursor:
+            cursor.executemany('''INSERT INTO "Twiddle Items" VALUES (%s, %s, %s, %s, %s, %s, %s, '2020-01-02 03:04:05', NULL)''',
+                               [(i, str(i), i, i, i, i / 4, False) for i in ids])
+
+    def get_datasource(self, **options):
+        config = configparser.ConfigParser()
+        config.read_dict(default_config)
+        ds_config = config['DsDatabasePostgres']
+        ds_config['DbServer'] = '{host}:{port}'.format(**pg_server)
+        ds_config['DbName'] = pg_server['dbname']
+        ds_config['DbUsername'] = pg_server['user']
+        ds_config['DbPassword'] = pg_server['password']
+        ds_config['WatermarkStore'] = os.path.join(self.tmpdir, 'watermarks.db')
+        ds_config['ResetWatermark'] = 'False'
+        for key, value in options.items():
+            ds_config[key] = value
+        return DsDatabasePostgres(config)
+
+    '''
+        Function that reads the table as the driver does
+
+        Params:
+            ds: datasource
+
+        Returns:
+            dataframe of the rows read, ordered by id
+    '''
+    def read(self, ds):
+        dfs = ds.read_data_to_df('Twiddle Items', dtype='str')
+        if isinstance(dfs, pd.DataFrame):
+            dfs = [dfs]
+        dfs = list(dfs)
+        ds.archive_data('Twiddle Items')
+        return pd.concat(dfs).sort_values('ID').reset_index(drop=True)
+
+    def test_list_quoted_table(self):
+        ds = self.get_datasource(TablePattern='Twiddle')
+        self.assertEqual(ds.get_table_list(), ['Twiddle Items'])
+        ds.close()
+
+    def test_column_types(self):
+        ds = self.get_datasource(ChunkSize='')
+        df = self.read(ds)
+        ds.close()
+
+        row = df.iloc[0]
+        self.assertEqual(len(df), 5)
+        self.assertEqual(row['CODE'], '00123')
+        self.assertEqual(row['BIG'], 9007199254740993)
+        self.assertEqual(str(df['BIG'].dtype), 'int64')
+        self.assertTrue(pd.isnull(row['N']))
+        self.assertEqual(str(df['N'].dtype), 'Int64')
+        self.assertEqual(row['PRICE'], Decimal('1.50'))
+        self.assertEqual(df['RATIO'].tolist(), [0.25, 0.5, 0.75, 1.0, 1.25])
+        self.assertEqual(df['FLAG'].tolist(), [True, False, False, False, False])
+        self.assertEqual(row['TS'], pd.Timestamp('2020-01-02 03:04:05'))
+        # empty strings are told apart from nulls
+        self.assertEqual(row['NOTE'], '')
+        self.assertTrue(pd.isnull(df.iloc[1]['NOTE']))
+
+    def test_chunks_and_watermark(self):
+        ds = self.get_datasource(ChunkSize='2', WatermarkColumn='id', WatermarkUnique='True')
+        dfs = list(ds.read_data_to_df('Twiddle Items', dtype='str'))
+        self.assertEqual([len(df) for df in dfs], [2, 2, 1])
+        ds.archive_data('Twiddle Items')
+
+        self.insert(range(6, 9))
+        self.assertEqual(self.read(ds)['ID'].tolist(), [6, 7, 8])
+        self.assertEqual(len(self.read(ds)), 0)
+        ds.close()
+
+    def test_composite_watermark_batches(self):
+        self.execute('UPDATE "Twiddle Items" SET ts = \'2020-01-01\' WHERE id < 4')
+        ds = self.get_datasource(ChunkSize='', WatermarkColumn='ts id', BatchSize='2')
+        self.assertEqual(self.read(ds)['ID'].tolist(), [1, 2, 3, 4, 5])
+
+        self.insert(range(6, 8))
+        self.assertEqual(self.read(ds)['ID'].tolist(), [6, 7])
+        ds.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
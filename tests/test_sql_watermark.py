@@ -0,0 +1,105 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import configparser
+
+import pandas as pd
+
+from twiddlepy.config import config as default_config
+from twiddlepy.datasources.ds_sql import DsDatabaseSqlite
+
+
+'''
+    Incremental reads of a Sqlite table by watermark, where several rows
+    share each value of the ts column
+'''
+class TestSqliteWatermark(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'source.db')
+        self.insert(range(9))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def insert(self, ids):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, ts INTEGER)')
+        conn.executemany('INSERT INTO items VALUES (?, ?)', [(i, i // 3) for i in ids])
+        conn.commit()
+        conn.close()
+
+    def get_datasource(self, **options):
+        config = configparser.ConfigParser()
+        config.read_dict(default_config)
+        ds_config = config['DsDatabaseSqlite']
+        ds_config['DbPath'] = self.db_path
+        ds_config['WatermarkStore'] = os.path.join(self.tmpdir, 'watermarks.db')
+        ds_config['ResetWatermark'] = 'False'
+        for key, value in options.items():
+            ds_config[key] = value
+        return DsDatabaseSqlite(config)
+
+    '''
+        Function that reads the table as the driver does
+
+        Params:
+            ds: datasource
+            fail_after: number of chunks read before the read fails, None to read all
+
+        Returns:
+            sorted ids read
+    '''
+    def read(self, ds, fail_after=None):
+        dfs = ds.read_data_to_df('items', dtype='str')
+        if isinstance(dfs, pd.DataFrame):
+            dfs = [dfs]
+        ids = []
+        for n, df in enumerate(dfs):
+            if n == fail_after:
+                dfs.close()
+                ds.archive_data('items', done=False)
+                return sorted(ids)
+            ids.extend(int(i) for i in df['ID'])
+        ds.archive_data('items')
+        return sorted(ids)
+
+    def test_batch_size_requires_unique_watermark(self):
+        with self.assertRaises(ValueError):
+            self.get_datasource(WatermarkColumn='ts', BatchSize='2')
+
+    def test_batches_of_composite_watermark(self):
+        ds = self.get_datasource(WatermarkColumn='ts id', BatchSize='2', ChunkSize='')
+        self.assertEqual(self.read(ds), list(range(9)))
+        self.insert(range(9, 12))
+        self.assertEqual(self.read(ds), [9, 10, 11])
+        ds.close()
+
+    def test_chunks_of_non_unique_watermark(self):
+        # a restart after a failed chunk reads the whole table again
+        ds = self.get_datasource(WatermarkColumn='ts', ChunkSize='2')
+        self.assertEqual(self.read(ds, fail_after=2), [0, 1, 2, 3])
+        ds.close()
+
+        ds = self.get_datasource(WatermarkColumn='ts', ChunkSize='2')
+        self.assertEqual(self.read(ds), list(range(9)))
+        self.insert(range(9, 12))
+        self.assertEqual(self.read(ds), [9, 10, 11])
+        ds.close()
+
+    def test_chunks_of_unique_watermark(self):
+        # a restart after a failed chunk reads from the last chunk committed
+        ds = self.get_datasource(WatermarkColumn='id', WatermarkUnique='True', ChunkSize='2')
+        self.assertEqual(self.read(ds, fail_after=2), [0, 1, 2, 3])
+        ds.close()
+
+        ds = self.get_datasource(WatermarkColumn='id', WatermarkUnique='True', ChunkSize='2')
+        self.assertEqual(self.read(ds), [4, 5, 6, 7, 8])
+        ds.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,5 @@
+import time
+
 
 '''
     Base class for all datasources
@@ -9,6 +11,33 @@ class DsBase:
         self.config = config
         self.ds_config_section = 'Ds' + ds_type.lower().title().replace('.', '')
         self.ds_unit = ''
+        self.mapper = None
+
+    '''
+        Function to set the mapper, the source fields it references can then
+        be pushed down to the data source.
+
+        Params:
+            mapper: Mapper object
+    '''
+    def set_mapper(self, mapper):
+        self.mapper = mapper
+
+
+    '''
+        Function that returns the source field names referenced by the mapper
+
+        Params:
+            dataset: dataset for which the source fields are returned, all datasets if None
+
+        Returns:
+            list of source field names, None if they are not known
+    '''
+    def get_source_fields(self, dataset=None):
+        if self.mapper is None:
+            return None
+        return self.mapper.get_source_field_names(dataset) or None
+
 
     '''
         Function to archive data.
@@ -22,6 +51,39 @@ class DsBase:
     def archive_data(self, unit_path, done=True):
         pass
 
+    '''
+        Function that returns the rows deleted from a data unit at the source,
+        for data sources that capture deletes
+
+        Params:
+            unit_path: filepath, tablename or metadata id
+
+        Returns:
+            dataframe of the key columns of deleted rows, None if there are none
+    '''
+    def get_deleted_rows(self, unit_path):
+        return None
+
+    '''
+        Function to wait for any pending work of the data source, e.g. archiving,
+        and release its resources
+    '''
+    def close(self):
+        pass
+
+    '''
+        Function to wait for source data between polling cycles
+
+        Params:
+            timeout: seconds to wait
+
+        Returns:
+            True if data became ready before the timeout
+    '''
+    def wait_for_data(self, timeout):
+        time.sleep(timeout)
+        return False
+
     '''
         Function that returns either a filepath, a table or a metadata id
     '''
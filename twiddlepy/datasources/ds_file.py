@@ -1,13 +1,247 @@
 import os
+import io
+import csv
+import mmap
+import time
+import pickle
+import multiprocessing
+import codecs
+import json
+import importlib.util
+import operator
+from functools import reduce
 from glob import glob
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 import pandas as pd
 from ast import literal_eval
 
-from twiddlepy.exceptions import LocationNotExist, SourceDataError
-from twiddlepy.utils import logger, file_age_in_seconds
+from twiddlepy.exceptions import LocationNotExist, SourceDataError, ExectionError
+from twiddlepy.utils import logger, file_age_in_seconds, flatten_document, get_path_value
+
+from twiddlepy.flatten import parse_path, explode
 
 from .ds_base import DsBase
+from .file_container import FileContainer, container_separator, compress_file, has_zstandard
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as pa_ds
+    import pyarrow.ipc as pa_ipc
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
+
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
+# compression inferred from the file extension the way pandas does, when compression is 'infer'
+try:
+    from pandas.io.common import infer_compression
+except ImportError:
+    from pandas.io.common import _infer_compression as infer_compression
+
+# Excel readers keyed on the config value, with the minimum pandas (major, minor) version supporting them
+excel_engines = {'xlrd': (0, 0), 'openpyxl': (0, 25), 'calamine': (2, 2)}
+pandas_version = tuple(int(v) for v in pd.__version__.split('.')[:2])
+
+# csv quoting modes keyed on the config value
+csv_quoting = {'minimal': csv.QUOTE_MINIMAL, 'all': csv.QUOTE_ALL, 'nonnumeric': csv.QUOTE_NONNUMERIC, 'none': csv.QUOTE_NONE}
+
+
+'''
+    Function to convert an arrow table or record batch into a pandas dataframe.
+    String conversion, if requested, is done by arrow so values are not
+    round-tripped through python objects before the dataframe is built.
+    Nested (list, struct and map) columns are not converted, they are kept
+    as python lists and dicts, like documents read from Mongo or JSON, for
+    their fields to be extracted by the source field paths.
+
+    Params:
+        table: arrow table or record batch
+        dtype: 'str' to convert every primitive column to string
+
+    Returns:
+        dataframe
+'''
+def arrow_to_df(table, dtype=None):
+    if isinstance(table, pa.RecordBatch):
+        table = pa.Table.from_batches([table])
+
+    names = table.schema.names
+    nested = [f.name for f in table.schema if pa.types.is_nested(f.type)]
+    if nested:
+        columns = {name: table.column(name).to_pylist() for name in nested}
+        table = table.select([name for name in names if name not in columns])
+
+    if dtype in ('str', str):
+        table = table.cast(pa.schema([pa.field(name, pa.string()) for name in table.schema.names]))
+
+    df = table.to_pandas()
+    for name in nested:
+        df.insert(names.index(name), name, pd.Series(columns[name], index=df.index, dtype=object))
+    return df
+
+
+'''
+    Function to convert filters into an arrow dataset expression. Filters follow
+    pyarrow.parquet conventions, a list of (column, op, value) tuples that are
+    ANDed, or a list of such lists that are ORed.
+
+    Params:
+        filters: list of filters
+
+    Returns:
+        arrow expression, None if there are no filters
+'''
+def filters_to_expression(filters):
+    if not filters:
+        return None
+
+    if not isinstance(filters[0], list):
+        filters = [filters]
+
+    ops = {
+        '=': operator.eq, '==': operator.eq, '!=': operator.ne,
+        '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+        'in': lambda f, v: f.isin(v),
+        'not in': lambda f, v: ~f.isin(v)
+    }
+
+    disjunction = []
+    for conjunction in filters:
+        exprs = []
+        for col, op, val in conjunction:
+            if op.lower() not in ops:
+                raise ValueError('Unrecognised filter operator "{}"'.format(op))
+            exprs.append(ops[op.lower()](pa_ds.field(col), val))
+        disjunction.append(reduce(operator.and_, exprs))
+
+    return reduce(operator.or_, disjunction)
+
+
+'''
+    Function to count the quote characters within a byte range of a file.
+    The range is scanned in blocks so that memory use stays bounded.
+
+    Params:
+        path: path of the file
+        start: start byte offset of the range
+        end: end byte offset of the range
+        quote: quote character as bytes
+
+    Returns:
+        number of quote characters in the range
+'''
+def count_quotes(path, start, end, quote, block_size=16*1024*1024):
+    count = 0
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for pos in range(start, end, block_size):
+            count += mm[pos:min(pos + block_size, end)].count(quote)
+    return count
+
+
+'''
+    Function to find the start of the first record at or after a byte offset,
+    i.e. the position following the first line break not within a quoted field.
+
+    Params:
+        mm: memory mapped file
+        offset: byte offset to search from
+        in_quote: if offset is within a quoted field
+        quote: quote character as bytes, None if quoting is disabled
+
+    Returns:
+        byte offset of the record start, or the file size if there is none
+'''
+def find_record_start(mm, offset, in_quote, quote):
+    size = len(mm)
+    pos = offset
+    while pos < size:
+        nl = mm.find(b'\n', pos)
+        if nl == -1:
+            return size
+        if quote is not None and mm[pos:nl].count(quote) % 2 == 1:
+            in_quote = not in_quote
+        if not in_quote:
+            return nl + 1
+        pos = nl + 1
+    return size
+
+
+'''
+    Function to read a byte range of a CSV file, aligned on record boundaries,
+    into a dataframe. Used by the process pool of DsFileCsv.
+
+    Params:
+        path: path of the file
+        start: start byte offset of the range
+        end: end byte offset of the range
+        names: column names from the header of the file
+        kwargs: pandas read_csv options
+
+    Returns:
+        dataframe
+'''
+def read_csv_range(path, start, end, names, kwargs):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        buf = io.BytesIO(mm[start:end])
+    return pd.read_csv(buf, header=None, names=names, **kwargs)
+
+
+'''
+    Function run in a worker process to parse a file with a custom file parser.
+    The dataframe is sent back over the pipe either as an arrow IPC stream or
+    pickled. Parsed columns are mostly object dtype (str), which pickle 5
+    out-of-band buffers would not save copying, so the pickle is sent whole.
+
+    Params:
+        conn: sending end of the pipe
+        file_parser: custom file parser
+        dfile: path of the file to parse
+        dtype: dictionary specifying column data types
+        transport: 'arrow' or 'pickle'
+'''
+def run_file_parser(conn, file_parser, dfile, dtype, transport):
+    try:
+        df = file_parser(dfile, dtype=dtype)
+        if transport == 'arrow':
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa_ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            conn.send(('arrow', None))
+            conn.send_bytes(sink.getvalue())
+        else:
+            conn.send(('pickle', None))
+            conn.send_bytes(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception as e:
+        conn.send(('error', str(e)))
+    finally:
+        conn.close()
+
+
+'''
+    Function to receive a dataframe sent by run_file_parser
+
+    Params:
+        conn: receiving end of the pipe
+
+    Returns:
+        dataframe
+'''
+def receive_parsed_df(conn):
+    kind, error = conn.recv()
+    if kind == 'error':
+        raise ExectionError(error)
+    if kind == 'arrow':
+        return pa_ipc.open_stream(conn.recv_bytes()).read_all().to_pandas()
+    return pickle.loads(conn.recv_bytes())
 
 '''
     Class for file based data sources, direct sub class 
@@ -28,7 +262,7 @@ class DsFileBase(DsBase):
     @classmethod
     def add_filename_to_df(cls, df, path):
         mdf = df.copy()
-        mdf['filename'] = os.path.basename(path)
+        mdf['filename'] = os.path.basename(path.split(container_separator)[-1])
         return mdf
 
 
@@ -44,6 +278,31 @@ class DsFileBase(DsBase):
         if ds_config['FilePattern'] != '':
             self.file_pattern = ds_config['FilePattern']
 
+        # zip/tar files whose members matching FilePattern are read as data units,
+        # only for the data sources that define ContainerPattern
+        self.container_patterns = ds_config.get('ContainerPattern', '').split()
+        self.container_threads = int(ds_config.get('ContainerThreads', '') or 1)
+        self.containers = {}
+
+        # files are archived by a pool of ArchiveWorkers threads, 0 to archive in the processing loop
+        self.archive_workers = int(ds_config['ArchiveWorkers'])
+        self.archive_pool = ThreadPoolExecutor(max_workers=self.archive_workers) if self.archive_workers > 0 else None
+        # files being archived, keyed on path, they are not data units until archived
+        self.archiving = {}
+        # failed background archives are retried ArchiveRetries times and then moved to
+        # the fail location, files that cannot be moved either are no longer data units
+        self.archive_retries = int(ds_config['ArchiveRetries'])
+        self.archive_failed = set()
+        self.archive_dirs = set()
+
+        self.archive_compression = ds_config['ArchiveCompression'].lower()
+        if self.archive_compression in ('', 'none'):
+            self.archive_compression = None
+        elif self.archive_compression not in ('gzip', 'zstd'):
+            raise ValueError('Unrecognised ArchiveCompression "{}"'.format(ds_config['ArchiveCompression']))
+        elif self.archive_compression == 'zstd' and not has_zstandard:
+            raise ValueError('zstandard must be installed for ArchiveCompression "zstd"')
+
 
     '''
         Function that moves a file to archive/fail location (after it has been processed)
@@ -56,6 +315,24 @@ class DsFileBase(DsBase):
             None
     '''
     def archive_data(self, filepath, done=True):
+        # data units read through metadata never list files, archives are checked here too
+        self.check_archiving()
+
+        if DsFileBase.is_container_member(filepath):
+            filepath, member = filepath.split(container_separator, 1)
+            container = self.get_container(filepath)
+            container.pending.discard(member)
+            if not done:
+                container.failed = True
+                logger.warning('Failed to process "{}" of "{}"'.format(member, filepath))
+            if container.pending:
+                return
+
+            # archive the container once all its members are processed
+            container.close()
+            del self.containers[filepath]
+            done = not container.failed
+
         if done:
             archive_location = self.archive_location
             archive_label = 'Archive'
@@ -69,15 +346,95 @@ class DsFileBase(DsBase):
             
         source_path = os.path.join(self.source_location, filepath)
         archive_path = os.path.join(archive_location, filepath)
+
+        if self.archive_pool is not None:
+            self.submit_archive(filepath, archive_path, archive_label)
+        else:
+            self.archive_file(source_path, archive_path, archive_label)
+
+
+    '''
+        Function that submits a file to be archived in the background
+
+        Params:
+            filepath: file to archive, relative to the source location
+            archive_path: path to archive the file to
+            archive_label: 'Archive' or 'Fail'
+            retries: number of times archiving the file has been retried
+
+        Returns:
+            None
+    '''
+    def submit_archive(self, filepath, archive_path, archive_label, retries=0):
+        source_path = os.path.join(self.source_location, filepath)
+        future = self.archive_pool.submit(self.archive_file, source_path, archive_path, archive_label)
+        self.archiving[filepath] = (future, archive_path, archive_label, retries)
+
+
+    '''
+        Function that moves, and optionally compresses, a file to the archive/fail location
+
+        Params:
+            source_path: file to archive
+            archive_path: path to archive the file to
+            archive_label: 'Archive' or 'Fail'
+
+        Returns:
+            None
+    '''
+    def archive_file(self, source_path, archive_path, archive_label):
         archive_base = os.path.dirname(archive_path)
         
-        if not os.path.exists(archive_base):
-            logger.info('{} directory {} does not exist, creating it.'.format(archive_label, archive_base))
-            os.makedirs(archive_base)
+        if archive_base not in self.archive_dirs:
+            if not os.path.exists(archive_base):
+                logger.info('{} directory {} does not exist, creating it.'.format(archive_label, archive_base))
+                os.makedirs(archive_base, exist_ok=True)
+            self.archive_dirs.add(archive_base)
 
-        logger.info('Archiving file to {}'.format(archive_path))
         if os.path.exists(source_path):
-            os.rename(source_path, archive_path)
+            archive_path = compress_file(source_path, archive_path, self.archive_compression)
+            logger.info('Archived file to {}'.format(archive_path))
+
+
+    '''
+        Function that checks the files being archived in the background. Files
+        that failed to archive are resubmitted up to ArchiveRetries times, then
+        moved to the fail location.
+
+        Returns:
+            None
+    '''
+    def check_archiving(self):
+        for filepath, (future, archive_path, archive_label, retries) in list(self.archiving.items()):
+            if not future.done():
+                continue
+            del self.archiving[filepath]
+            error = future.exception()
+            if error is None:
+                continue
+
+            if retries < self.archive_retries:
+                logger.warning('Failed to archive file "{}" due to error {}, retrying'.format(filepath, error))
+                self.submit_archive(filepath, archive_path, archive_label, retries + 1)
+            elif archive_label == 'Archive' and self.fail_location:
+                logger.error('Failed to archive file "{}" due to error {}, moving it to the fail location'.format(filepath, error))
+                self.submit_archive(filepath, os.path.join(self.fail_location, filepath), 'Fail')
+            else:
+                logger.error('Failed to move file "{}" to the fail location due to error {}, it is no longer read'.format(filepath, error))
+                self.archive_failed.add(filepath)
+
+
+    '''
+        Function that waits for the files being archived
+
+        Returns:
+            None
+    '''
+    def close(self):
+        # retries and moves to the fail location are waited for too
+        while self.archiving:
+            wait([future for future, _, _, _ in self.archiving.values()])
+            self.check_archiving()
 
 
     '''
@@ -95,9 +452,78 @@ class DsFileBase(DsBase):
         if not dirpath.endswith('/'):
             dirpath += '/'
 
-        dfiles = [f for d in os.walk(dirpath) for f in glob(os.path.join(d[0], self.file_pattern)) if file_age_in_seconds(f)>file_age]
+        self.check_archiving()
+
+        dfiles = [f for d in os.walk(dirpath) for f in glob(os.path.join(d[0], self.file_pattern)) 
+                    if f.replace(dirpath, '') not in self.archiving and f.replace(dirpath, '') not in self.archive_failed
+                    and file_age_in_seconds(f)>file_age]
+
+        if not self.container_patterns:
+            return [f.replace(dirpath, '') for f in dfiles]
+
+        cfiles = sorted(set(f for d in os.walk(dirpath) for p in self.container_patterns for f in glob(os.path.join(d[0], p)) if file_age_in_seconds(f)>file_age))
+        dfiles = [f.replace(dirpath, '') for f in dfiles if f not in cfiles]
+
+        for cf in cfiles:
+            cpath = cf.replace(dirpath, '')
+            if cpath in self.containers or cpath in self.archiving or cpath in self.archive_failed:
+                continue
+            container = self.get_container(cpath)
+            if not container.pending:
+                # moved to the fail location, so it is not listed again
+                logger.warning('No files matching "{}" in "{}"'.format(self.file_pattern, cpath))
+                del self.containers[cpath]
+                self.archive_data(cpath, done=False)
+                continue
+            dfiles.extend(cpath + container_separator + m for m in sorted(container.pending))
+
+        return dfiles
+
+
+    '''
+        Function that returns a container file, opened on first use. All its
+        members matching FilePattern are pending until they are archived,
+        including for members read through metadata.
+
+        Params:
+            cpath: path of the container relative to the source location
+
+        Returns:
+            FileContainer object
+    '''
+    def get_container(self, cpath):
+        if cpath not in self.containers:
+            container = FileContainer(os.path.join(self.source_location, cpath), threads=self.container_threads)
+            container.pending = set(container.list_members(self.file_pattern))
+            self.containers[cpath] = container
+        return self.containers[cpath]
+
+
+    '''
+        Class function to check if a data unit is a member of a container file
+
+        Params:
+            datafile: data unit
+    '''
+    @classmethod
+    def is_container_member(cls, datafile):
+        return container_separator in datafile
+
+
+    '''
+        Function to open a data file, or a member of a container file, for reading
+
+        Params:
+            datafile: path of the file relative to the source location
 
-        return [f.replace(dirpath, '') for f in dfiles]
+        Returns:
+            binary file object
+    '''
+    def open_data_file(self, datafile):
+        if DsFileBase.is_container_member(datafile):
+            cpath, member = datafile.split(container_separator, 1)
+            return self.get_container(cpath).open_member(member)
+        return open(os.path.join(self.source_location, datafile), 'rb')
 
     '''
         Function that is essentially alias of get_data_files()
@@ -125,7 +551,48 @@ class DsFileCsv(DsFileBase):
         # Allows for files to be loaded that have compression e.g. gzip
         # Default option is 'infer'
         self.compression = ds_config['Compression']
+
+        self.quote_char = ds_config['QuoteChar']
+        if ds_config['Quoting'].lower() not in csv_quoting:
+            raise ValueError('Unrecognised Quoting "{}" for {}'.format(ds_config['Quoting'], self.ds_config_section))
+        self.quoting = csv_quoting[ds_config['Quoting'].lower()]
+        self.encoding = ds_config['Encoding'] if ds_config['Encoding'] != '' else None
+        self.block_size = int(ds_config['BlockSize']) if ds_config['BlockSize'] != '' else None
+
+        self.csv_readers = {
+            'pandas': self.read_csv_pandas,
+            'pyarrow': self.read_csv_pyarrow
+        }
+
+        self.engine = ds_config['Engine'].lower() if ds_config['Engine'] != '' else 'pandas'
+        if self.engine not in self.csv_readers:
+            raise ValueError('Unrecognised CSV engine "{}"'.format(ds_config['Engine']))
+        if self.engine == 'pyarrow' and not has_pyarrow:
+            logger.warning('CSV engine "pyarrow" is not installed, using "pandas" instead')
+            self.engine = 'pandas'
+
+        # Files larger than ParallelThreshold bytes are split into byte ranges
+        # parsed in a process pool, empty threshold disables splitting
+        self.parallel_threshold = int(ds_config['ParallelThreshold']) if ds_config['ParallelThreshold'] != '' else None
+        self.parallel_workers = int(ds_config['ParallelWorkers']) if ds_config['ParallelWorkers'] != '' else os.cpu_count()
+        self.parallel_chunk_size = int(ds_config['ParallelChunkSize'])
+
     
+    '''
+        Function to return the pandas compression for a file, None if it is not compressed
+
+        Params:
+            datafile -- Path to the CSV, or container member
+    '''
+    def get_compression(self, datafile):
+        if self.compression == 'infer':
+            # a member is decompressed by its container, only its own extension counts
+            return infer_compression(datafile.split(container_separator)[-1], 'infer')
+        if self.compression.lower() in ('', 'none'):
+            return None
+        return self.compression
+
+
     '''
         Function that returns a dataframe generator object for the files in 
         the specified data source location 
@@ -133,19 +600,179 @@ class DsFileCsv(DsFileBase):
         Params:
             datafile -- Path to the CSV to read
             dtype -- dictionary specifying column data types 
-            sep -- column separator
-            decimal -- decimal point character
     '''
     def read_data_to_df(self, datafile, dtype=None):
         try:
             logger.info('Reading file {}'.format(datafile))
             dfile = os.path.join(self.source_location, datafile)
-            df = pd.read_csv(dfile, dtype=dtype, sep=self.column_separator, decimal=self.decimal_point, quotechar="'", compression=self.compression)
+            if DsFileBase.is_container_member(datafile):
+                with self.open_data_file(datafile) as stream:
+                    df = self.read_csv_pandas(stream, dtype=dtype, compression=self.get_compression(datafile))
+            elif self.can_split(dfile):
+                return self.read_csv_parallel(dfile, datafile, dtype=dtype)
+            else:
+                df = self.csv_readers[self.engine](dfile, dtype=dtype)
             df = DsFileBase.add_filename_to_df(df, datafile)
             return df
         except Exception as e:
             logger.error('Failed to read file "{}" due to error {}'.format(datafile, e))
             raise SourceDataError('Failed to read file "{}"'.format(datafile))
+
+
+    '''
+        Function to check if a file should be parsed in byte ranges by the process pool.
+        Only uncompressed files with an ASCII compatible encoding, above the
+        size threshold, are split. The pyarrow engine is multi-threaded already.
+
+        Params:
+            dfile -- Path to the CSV
+    '''
+    def can_split(self, dfile):
+        if self.parallel_threshold is None or self.engine != 'pandas' or self.parallel_workers < 2:
+            return False
+        if self.get_compression(dfile) is not None:
+            return False
+        if self.encoding is not None and codecs.lookup(self.encoding).name.startswith(('utf-16', 'utf-32')):
+            return False
+        return os.path.getsize(dfile) > self.parallel_threshold
+
+
+    '''
+        Function that memory maps a CSV file, splits it into byte ranges aligned
+        on record boundaries and parses the ranges in a process pool. Quotes are
+        counted per range first so that line breaks within quoted fields are
+        never taken as record boundaries.
+
+        Params:
+            dfile -- Path to the CSV to read
+            datafile -- Path of the CSV relative to the source location
+            dtype -- dictionary specifying column data types 
+
+        Returns:
+            generator of dataframes, in file order
+    '''
+    def read_csv_parallel(self, dfile, datafile, dtype=None):
+        kwargs = {'dtype': dtype, 'sep': self.column_separator, 'decimal': self.decimal_point,
+                  'quotechar': self.quote_char, 'quoting': self.quoting, 'encoding': self.encoding}
+        quote = self.quote_char.encode(self.encoding or 'utf-8') if self.quoting != csv.QUOTE_NONE else None
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.parallel_workers) as pool:
+                with open(dfile, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    size = len(mm)
+                    header_end = find_record_start(mm, 0, False, quote)
+                    names = list(pd.read_csv(io.BytesIO(mm[:header_end]), nrows=0, **kwargs).columns)
+                    columns = self.get_source_fields()
+                    if columns is not None:
+                        kwargs['usecols'] = [c for c in names if c in columns]
+
+                    offsets = list(range(header_end, size, self.parallel_chunk_size))
+                    if quote is not None:
+                        ends = offsets[1:] + [size]
+                        counts = pool.map(count_quotes, [dfile]*len(offsets), offsets, ends, [quote]*len(offsets))
+                    else:
+                        counts = [0]*len(offsets)
+
+                    starts = []
+                    quotes_before = 0
+                    for offset, count in zip(offsets, counts):
+                        start = offset if offset == header_end else find_record_start(mm, offset, quotes_before % 2 == 1, quote)
+                        if not starts or start > starts[-1]:
+                            starts.append(start)
+                        quotes_before += count
+                
+                ranges = [(start, end) for start, end in zip(starts, starts[1:] + [size]) if end > start]
+                logger.info('Parsing file {} in {} byte ranges'.format(datafile, len(ranges)))
+
+                futures = deque()
+                for start, end in ranges:
+                    futures.append(pool.submit(read_csv_range, dfile, start, end, names, kwargs))
+                    if len(futures) >= 2*self.parallel_workers:
+                        yield DsFileBase.add_filename_to_df(futures.popleft().result(), datafile)
+                while futures:
+                    yield DsFileBase.add_filename_to_df(futures.popleft().result(), datafile)
+        except Exception as e:
+            logger.error('Failed to read file "{}" due to error {}'.format(datafile, e))
+            raise SourceDataError('Failed to read file "{}"'.format(datafile))
+
+
+    '''
+        Function that reads a CSV file with the pandas C parser
+
+        Params:
+            dfile -- Path to, or file object of, the CSV to read
+            dtype -- dictionary specifying column data types 
+            compression -- compression of a file object, paths are inferred from the extension
+    '''
+    def read_csv_pandas(self, dfile, dtype=None, compression=None):
+        is_path = isinstance(dfile, str)
+        if is_path:
+            compression = self.get_compression(dfile)
+        columns = self.get_source_fields()
+        usecols = (lambda c: c in columns) if columns is not None else None
+        return pd.read_csv(dfile, dtype=dtype, sep=self.column_separator, decimal=self.decimal_point,
+                    quotechar=self.quote_char, quoting=self.quoting, encoding=self.encoding,
+                    compression=compression, memory_map=is_path and compression is None, usecols=usecols)
+
+
+    '''
+        Function that returns the column names from the header of a CSV file
+
+        Params:
+            dfile -- Path to the CSV
+    '''
+    def read_header(self, dfile):
+        return list(pd.read_csv(dfile, nrows=0, sep=self.column_separator, quotechar=self.quote_char,
+                    quoting=self.quoting, encoding=self.encoding, compression=self.get_compression(dfile)).columns)
+
+
+    '''
+        Function that reads a CSV file with the multi-threaded pyarrow parser,
+        uncompressed files are memory mapped. Compressions and separators not
+        supported by arrow are read with the pandas parser.
+
+        Params:
+            dfile -- Path to the CSV to read
+            dtype -- dictionary specifying column data types 
+    '''
+    def read_csv_pyarrow(self, dfile, dtype=None):
+        compression = self.get_compression(dfile)
+        if compression not in (None, 'gzip', 'bz2') or len(self.column_separator) != 1:
+            logger.debug('CSV engine "pyarrow" cannot read "{}", using "pandas" instead'.format(dfile))
+            return self.read_csv_pandas(dfile, dtype=dtype)
+
+        read_kwargs = {}
+        if self.encoding is not None:
+            read_kwargs['encoding'] = self.encoding
+        if self.block_size is not None:
+            read_kwargs['block_size'] = self.block_size
+
+        convert_kwargs = {'strings_can_be_null': True}
+        if self.decimal_point != '.':
+            convert_kwargs['decimal_point'] = self.decimal_point
+        columns = self.get_source_fields()
+        header = self.read_header(dfile) if columns is not None or dtype in ('str', str) else None
+        if dtype in ('str', str):
+            # read as text, so values are not converted by type inference first
+            convert_kwargs['column_types'] = {c: pa.string() for c in header}
+        elif isinstance(dtype, dict):
+            convert_kwargs['column_types'] = {c: pa.string() for c, t in dtype.items() if t in ('str', str)}
+        if columns is not None:
+            convert_kwargs['include_columns'] = [c for c in header if c in columns]
+
+        quote_char = self.quote_char if self.quoting != csv.QUOTE_NONE else False
+
+        if compression is None:
+            source = pa.memory_map(dfile, 'r')
+        else:
+            source = pa.input_stream(dfile, compression=compression)
+
+        with source:
+            table = pa_csv.read_csv(source, read_options=pa_csv.ReadOptions(**read_kwargs),
+                        parse_options=pa_csv.ParseOptions(delimiter=self.column_separator, quote_char=quote_char),
+                        convert_options=pa_csv.ConvertOptions(**convert_kwargs))
+
+        return arrow_to_df(table, dtype=dtype)
     
          
     '''
@@ -173,14 +800,146 @@ class DsFileJson(DsFileBase):
     def read_data_to_df(self, datafile, dtype=None):
         try:
             logger.info('Reading file {}'.format(datafile))
-            dfile = os.path.join(self.source_location, datafile)
-            df = pd.read_json(dfile, dtype=dtype)
+            with self.open_data_file(datafile) as stream:
+                df = pd.read_json(stream, dtype=dtype)
             df = DsFileBase.add_filename_to_df(df, datafile)
             return df
         except Exception as e:
             logger.error('Failed to read file "{}" due to error {}'.format(datafile, e))
             raise SourceDataError('Failed to read file "{}"'.format(datafile))
          
+'''
+    Class for reading newline delimited JSON data sources and convert into pandas dataframes.
+
+    The file is parsed line by line and yielded in chunks of ChunkSize rows.
+    Nested documents are flattened on the dotted source field names of the
+    mapper, e.g. "address.city", and keys the mapper does not reference are
+    dropped as each line is parsed.
+'''
+class DsFileJsonl(DsFileBase):
+    def __init__(self, config):
+        super().__init__('file.jsonl', config)
+
+        ds_config = config[self.ds_config_section]
+        self.chunksize = int(ds_config['ChunkSize'])
+        self.encoding = ds_config['Encoding'] if ds_config['Encoding'] != '' else None
+
+    '''
+        Function that returns a dataframe generator object for the specified file
+
+        Params:
+            datafile -- Path to the JSON lines file to read
+            dtype -- dictionary specifying column data types 
+    '''
+    def read_data_to_df(self, datafile, dtype=None):
+        logger.info('Reading file {}'.format(datafile))
+
+        fields = self.get_source_fields()
+        raw = set()
+        if fields is not None:
+            paths = []
+            for name in fields:
+                steps = parse_path(name)
+                if steps is None:
+                    paths.append((name, (name,)))
+                elif explode in steps:
+                    # exploded by the driver, the document the array is in is read as is
+                    if steps[0] not in raw:
+                        raw.add(steps[0])
+                        paths.append((steps[0], (steps[0],)))
+                else:
+                    paths.append((name, tuple(steps)))
+        else:
+            paths = None
+
+        return self.read_chunks(datafile, paths, dtype=dtype, raw=raw)
+
+
+    '''
+        Function that parses the lines of a file into dataframes of chunksize rows
+
+        Params:
+            datafile -- Path of the file relative to the source location
+            paths -- list of (field name, path) to extract, all fields if None
+            dtype -- dictionary specifying column data types 
+            raw -- fields whose values are kept as parsed, e.g. arrays to explode
+    '''
+    def read_chunks(self, datafile, paths, dtype=None, raw=()):
+        to_str = dtype in ('str', str)
+        rows = []
+        line_no = 0
+        try:
+            with io.TextIOWrapper(self.open_data_file(datafile), encoding=self.encoding) as f:
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+
+                    doc = json_loads(line)
+                    if paths is not None:
+                        row = {name: doc[name] if name in doc else get_path_value(doc, path) for name, path in paths}
+                    else:
+                        row = flatten_document(doc)
+
+                    if to_str:
+                        row = {k: v if k in raw else DsFileJsonl.value_to_str(v) for k, v in row.items()}
+                    rows.append(row)
+
+                    if len(rows) >= self.chunksize:
+                        yield self.rows_to_df(rows, datafile, paths)
+                        rows = []
+
+            if rows:
+                yield self.rows_to_df(rows, datafile, paths)
+        except ValueError as e:
+            logger.error('Failed to read file "{}" at line {} due to error {}'.format(datafile, line_no, e))
+            raise SourceDataError('Failed to read file "{}"'.format(datafile))
+        except OSError as e:
+            logger.error('Failed to read file "{}" due to error {}'.format(datafile, e))
+            raise SourceDataError('Failed to read file "{}"'.format(datafile))
+
+
+    '''
+        Function to build a dataframe from parsed rows
+
+        Params:
+            rows -- list of dicts
+            datafile -- Path of the file the rows are read from
+            paths -- list of (field name, path) extracted, None if all fields
+
+        Returns:
+            dataframe
+    '''
+    def rows_to_df(self, rows, datafile, paths):
+        if paths is not None:
+            df = pd.DataFrame(rows, columns=[f for f, _ in paths])
+        else:
+            df = pd.DataFrame(rows)
+        return DsFileBase.add_filename_to_df(df, datafile)
+
+
+    '''
+        Function to convert a JSON value to str, nested values are dumped as JSON
+
+        Params:
+            value -- JSON value
+
+        Returns:
+            str value, None if value is null
+    '''
+    @classmethod
+    def value_to_str(cls, value):
+        if value is None or isinstance(value, str):
+            return value
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return str(value)
+         
+    '''
+        Function to return label for the data source
+    '''
+    def get_label(self):
+        return 'JSON lines file'
+
 '''
     Class for reading MS Excel data sources and convert into pandas dataframe.
 '''
@@ -194,33 +953,80 @@ class DsFileExcel(DsFileBase):
         else:
             self.sheets = ds_config['Sheets'].split()
             #
-            # use string so that pd.read_excel returns a dataframe
+            # use string so that a dataframe is returned
             if len(self.sheets) == 1:
                 self.sheets = self.sheets[0]
 
+        self.engine = ds_config['Engine'].lower() if ds_config['Engine'] != '' else None
+        if self.engine is not None and self.engine not in excel_engines:
+            raise ValueError('Unrecognised Excel engine "{}"'.format(ds_config['Engine']))
+        if self.engine is not None and pandas_version < excel_engines[self.engine]:
+            logger.warning('Excel engine "{}" requires pandas {}.{}, using the pandas default instead'.format(self.engine, *excel_engines[self.engine]))
+            self.engine = None
+        if self.engine == 'calamine' and importlib.util.find_spec('python_calamine') is None:
+            logger.warning('Excel engine "calamine" is not installed, using the pandas default instead')
+            self.engine = None
+
+        self.stream_sheets = ds_config['StreamSheets'].lower() == 'true'
+
     
     '''
         Function that returns a dataframe or dict of dataframes
-        for a specified file 
+        for a specified file. If StreamSheets is set, a generator
+        is returned instead, yielding a dict for one sheet at a time.
 
         Params:
             datafile: Path to MS the Excel to read
             dtype: dictionary specifying column data types 
     '''
     def read_data_to_df(self, datafile, dtype=None):
+        logger.info('Reading file {}'.format(datafile))
+        dfile = os.path.join(self.source_location, datafile)
+        if DsFileBase.is_container_member(datafile):
+            # excel readers need a seekable file
+            with self.open_data_file(datafile) as stream:
+                dfile = io.BytesIO(stream.read())
+
+        if self.stream_sheets and not isinstance(self.sheets, str):
+            return (OrderedDict([sheet]) for sheet in self.read_sheets(dfile, datafile, dtype=dtype))
+
+        dfs = OrderedDict(self.read_sheets(dfile, datafile, dtype=dtype))
+        if isinstance(self.sheets, str):
+            return dfs[self.sheets]
+        return dfs
+
+
+    '''
+        Function that reads the sheets of a file one at a time, only the
+        columns the mapper references for the sheet (dataset) are kept.
+
+        Params:
+            dfile: Path to, or file object of, the MS Excel to read
+            datafile: Path of the file relative to the source location
+            dtype: dictionary specifying column data types 
+
+        Returns:
+            generator of (sheet name, dataframe)
+    '''
+    def read_sheets(self, dfile, datafile, dtype=None):
         try:
-            logger.info('Reading file {}'.format(datafile))
-            dfile = os.path.join(self.source_location, datafile)
-            dfs = pd.read_excel(dfile, dtype=dtype, sheet_name=self.sheets)
-            if isinstance(dfs, OrderedDict):
-                mdfs = {}
-                for _, (name, sheet_df) in enumerate(dfs.items()):
+            with pd.ExcelFile(dfile, engine=self.engine) as xls:
+                if self.sheets is None:
+                    sheets = xls.sheet_names
+                elif isinstance(self.sheets, str):
+                    sheets = [self.sheets]
+                else:
+                    sheets = self.sheets
+
+                for name in sheets:
+                    columns = self.get_source_fields(dataset=name) or self.get_source_fields()
+                    usecols = (lambda c: c in columns) if columns is not None else None
+
+                    sheet_df = xls.parse(name, dtype=dtype, usecols=usecols)
                     sheet_df = DsFileBase.add_filename_to_df(sheet_df, datafile)
-                    sheet_df['sheetname'] = name
-                    mdfs[name] = sheet_df
-            else:
-                mdfs = DsFileBase.add_filename_to_df(dfs, datafile)
-            return dfs
+                    if not isinstance(self.sheets, str):
+                        sheet_df['sheetname'] = name
+                    yield name, sheet_df
         except Exception as e:
             logger.error('Failed to read file "{}" due to error {}'.format(datafile, e))
             raise SourceDataError('Failed to read file "{}"'.format(datafile))
@@ -253,6 +1059,32 @@ class DsFileCustom(DsFileBase):
         if self.file_parser is None:
             raise ValueError('FileParser "{}" not found in local_functions.py'.format(file_parser_name))
 
+        # files are parsed by up to Workers processes, 0 to parse in-process
+        self.workers = int(ds_config['Workers'])
+        self.timeout = float(ds_config['Timeout']) if ds_config['Timeout'] != '' else None
+        self.transport = ds_config['Transport'].lower()
+        if self.transport not in ('pickle', 'arrow'):
+            raise ValueError('Unrecognised Transport "{}"'.format(ds_config['Transport']))
+        if self.transport == 'arrow' and not has_pyarrow:
+            logger.warning('Transport "arrow" requires pyarrow, using "pickle" instead')
+            self.transport = 'pickle'
+
+        # files waiting for a worker, and the workers parsing files keyed on the file
+        self.queued = deque()
+        self.parsing = {}
+        self.parse_dtype = None
+
+
+    '''
+        Function that returns the data files, which are queued for parsing in
+        worker processes when Workers is set.
+    '''
+    def get_data_units(self):
+        dfiles = self.get_data_files()
+        if self.workers > 0:
+            self.queued.extend(f for f in dfiles if f not in self.parsing and f not in self.queued)
+        return dfiles
+
     
     '''
         Function that returns a dataframe generator object for the files in 
@@ -266,16 +1098,189 @@ class DsFileCustom(DsFileBase):
         try:
             logger.info('Reading file {}'.format(datafile))
             dfile = os.path.join(self.source_location, datafile)
-            df = self.file_parser(dfile, dtype=dtype)
+            if self.workers > 0:
+                df = self.read_in_worker(datafile, dtype=dtype)
+            else:
+                df = self.file_parser(dfile, dtype=dtype)
             df = DsFileBase.add_filename_to_df(df, datafile)
             return df
         except Exception as e:
             logger.error('Failed to read file "{}" due to error {}'.format(datafile, e))
             raise SourceDataError('Failed to read file "{}"'.format(datafile))
 
+
+    '''
+        Function that returns the dataframe of a file parsed in a worker process.
+        Queued files are parsed ahead by the other workers meanwhile. The
+        worker is killed if the file is not parsed within Timeout seconds.
+
+        Params:
+            datafile -- Path of the file relative to the source location
+            dtype -- dictionary specifying column data types 
+    '''
+    def read_in_worker(self, datafile, dtype=None):
+        if dtype != self.parse_dtype:
+            # files parsed ahead with another dtype are parsed again
+            self.queued.extendleft(reversed(self.stop_workers()))
+            self.parse_dtype = dtype
+
+        if datafile not in self.parsing:
+            if datafile in self.queued:
+                self.queued.remove(datafile)
+            self.queued.appendleft(datafile)
+        self.start_workers()
+
+        process, conn, started = self.parsing.pop(datafile)
+        try:
+            remaining = None if self.timeout is None else max(0, started + self.timeout - time.time())
+            if not conn.poll(remaining):
+                process.kill()
+                raise ExectionError('Parsing file "{}" timed out after {} seconds'.format(datafile, self.timeout))
+            return receive_parsed_df(conn)
+        finally:
+            conn.close()
+            process.join()
+            self.start_workers()
+
+
+    '''
+        Function that starts worker processes for the queued files, up to Workers
+    '''
+    def start_workers(self):
+        while self.queued and len(self.parsing) < self.workers:
+            datafile = self.queued.popleft()
+            dfile = os.path.join(self.source_location, datafile)
+            recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=run_file_parser, args=(send_conn, self.file_parser, dfile, self.parse_dtype, self.transport), daemon=True)
+            process.start()
+            send_conn.close()
+            self.parsing[datafile] = (process, recv_conn, time.time())
+
+
+    '''
+        Function that kills the worker processes
+
+        Returns:
+            list of the files that were being parsed
+    '''
+    def stop_workers(self):
+        for process, conn, _ in self.parsing.values():
+            process.kill()
+            conn.close()
+            process.join()
+        stopped = list(self.parsing)
+        self.parsing = {}
+        return stopped
+
+
+    '''
+        Function that stops the worker processes and waits for pending archiving
+    '''
+    def close(self):
+        self.stop_workers()
+        self.queued.clear()
+        super().close()
+
     '''
         Function to return label for the data source
     '''
     def get_label(self):
         return 'Custom file'
          
+
+'''
+    Class for reading arrow based columnar files, direct sub class
+    include DsFileParquet and DsFileFeather.
+
+    Only the columns referenced by the mapper are read, the filters are pushed
+    down to the reader so row groups are skipped using their statistics, and
+    the file is streamed in batches of at most BatchSize rows.
+'''
+class DsFileArrowBase(DsFileBase):
+    def __init__(self, ds_type, config, file_format):
+        super().__init__(ds_type, config)
+        if not has_pyarrow:
+            raise ValueError('pyarrow must be installed to use {}'.format(self.ds_config_section))
+
+        ds_config = config[self.ds_config_section]
+        self.file_format = file_format
+        self.batch_size = int(ds_config['BatchSize'])
+
+        if ds_config['Filters'] != '':
+            self.filter_expression = filters_to_expression(literal_eval(ds_config['Filters']))
+        else:
+            self.filter_expression = None
+
+
+    '''
+        Function that returns a dataframe generator object for the specified file
+
+        Params:
+            datafile -- Path to the file to read
+            dtype -- dictionary specifying column data types 
+    '''
+    def read_data_to_df(self, datafile, dtype=None):
+        try:
+            logger.info('Reading file {}'.format(datafile))
+            dfile = os.path.join(self.source_location, datafile)
+            dataset = pa_ds.dataset(dfile, format=self.file_format)
+
+            columns = self.get_source_fields()
+            if columns is not None:
+                # nested fields, e.g. address.city, are read with their root column
+                roots = set(steps[0] for steps in map(parse_path, columns) if steps is not None)
+                projected = [c for c in dataset.schema.names if c in columns or c in roots]
+                if not projected:
+                    logger.warning('None of the mapper source fields are in file "{}", reading all columns'.format(datafile))
+                columns = projected or None
+
+            batches = dataset.to_batches(columns=columns, filter=self.filter_expression, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error('Failed to read file "{}" due to error {}'.format(datafile, e))
+            raise SourceDataError('Failed to read file "{}"'.format(datafile))
+
+        return self.read_batches(batches, datafile, dtype=dtype)
+
+
+    '''
+        Function that converts arrow record batches into dataframes
+
+        Params:
+            batches -- iterator of record batches
+            datafile -- Path of the file the batches are read from
+            dtype -- dictionary specifying column data types 
+    '''
+    def read_batches(self, batches, datafile, dtype=None):
+        try:
+            for batch in batches:
+                if batch.num_rows > 0:
+                    yield DsFileBase.add_filename_to_df(arrow_to_df(batch, dtype=dtype), datafile)
+        except Exception as e:
+            logger.error('Failed to read file "{}" due to error {}'.format(datafile, e))
+            raise SourceDataError('Failed to read file "{}"'.format(datafile))
+
+'''
+    Class for reading Parquet data sources and convert into pandas dataframes.
+'''
+class DsFileParquet(DsFileArrowBase):
+    def __init__(self, config):
+        super().__init__('file.parquet', config, 'parquet')
+
+    '''
+        Function to return label for the data source
+    '''
+    def get_label(self):
+        return 'Parquet file'
+
+'''
+    Class for reading Feather/Arrow IPC data sources and convert into pandas dataframes.
+'''
+class DsFileFeather(DsFileArrowBase):
+    def __init__(self, config):
+        super().__init__('file.feather', config, 'ipc')
+
+    '''
+        Function to return label for the data source
+    '''
+    def get_label(self):
+        return 'Arrow IPC file'
@@ -1,15 +1,18 @@
 import os, sys
-from glob import glob
+import threading
+from fnmatch import fnmatch
 import json
 import copy
 from datetime import datetime
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from collections.abc import Iterator
 import pandas as pd
 
 from twiddlepy.exceptions import SourceDataError, ExectionError
 from twiddlepy.utils import logger, file_age_in_seconds
 
 from kazoo.client import KazooClient
+from kazoo.recipe.cache import TreeCache, TreeEvent
 
 from .ds_file import *
 from .ds_sql import *
@@ -56,6 +59,26 @@ class DsMetadataBase(DsBase):
         else:
             self.metadata_proc = None
 
+    '''
+        Function to set the mapper for this and the datasources the metadata refers to
+
+        Params:
+            mapper: Mapper object
+    '''
+    def set_mapper(self, mapper):
+        super().set_mapper(mapper)
+        for ds in self.datasources.values():
+            ds.set_mapper(mapper)
+
+
+    '''
+        Function to close the datasources the metadata refers to
+    '''
+    def close(self):
+        for ds in self.datasources.values():
+            ds.close()
+
+
     '''
         Function that returns list of metadata ids for
         status being 'READY'
@@ -114,6 +137,7 @@ class DsMetadataBase(DsBase):
                 logger.error('Unrecognised datasource type "{}".'.format(src_metadata['type']))
                 raise SourceDataError('Unrecognised datasource type "{}".'.format(src_metadata['type']))
             self.datasources[ds_config_section] = ds_cls(self.config)
+            self.datasources[ds_config_section].set_mapper(self.mapper)
 
         source_name = src_metadata.get('source_name', None)
         if source_name is None:
@@ -124,15 +148,71 @@ class DsMetadataBase(DsBase):
         df = self.datasources[ds_config_section].read_data_to_df(source_name, dtype=dtype)
 
         if self.metadata_proc is not None:
-            try:
-                df = self.metadata_proc(df, src_metadata)
-            except Exception as e:
-                logger.error('Failed to execute metadata processor "{}" due to error {}'.format(self.metadata_proc_name, e))
-                raise ExectionError('Failed to execute metadata processor "{}"'.format(self.metadata_proc_name))
+            # datasources read in chunks return a generator, processed chunk by chunk
+            if isinstance(df, Iterator):
+                return self.process_chunks(df, src_metadata)
+            df = self.run_metadata_proc(df, src_metadata)
 
         return df
+
+
+    '''
+        Function that returns a generator applying the metadata processor to
+        each chunk read from a datasource
+
+        Params:
+            dfs: generator of dataframes
+            src_metadata: metadata of the job
+
+        Returns:
+            generator of processed dataframes
+    '''
+    def process_chunks(self, dfs, src_metadata):
+        try:
+            for df in dfs:
+                yield self.run_metadata_proc(df, src_metadata)
+        finally:
+            # cursors and streams of the datasource are closed with it
+            if hasattr(dfs, 'close'):
+                dfs.close()
+
+
+    '''
+        Function that applies the metadata processor to a dataframe
+
+        Params:
+            df: dataframe, or dict of dataframes
+            src_metadata: metadata of the job
+
+        Returns:
+            processed dataframe
+    '''
+    def run_metadata_proc(self, df, src_metadata):
+        try:
+            return self.metadata_proc(df, src_metadata)
+        except Exception as e:
+            logger.error('Failed to execute metadata processor "{}" due to error {}'.format(self.metadata_proc_name, e))
+            raise ExectionError('Failed to execute metadata processor "{}"'.format(self.metadata_proc_name))
     
 
+    '''
+        Function that returns the rows deleted from the source of a job
+
+        Params:
+            mda_id: metadata id
+
+        Returns:
+            dataframe of the key columns of deleted rows, None if there are none
+    '''
+    def get_deleted_rows(self, mda_id):
+        src_metadata = self.source_metadata[mda_id]
+        ds_config_section = 'Ds' + src_metadata['type'].lower().title().replace('.', '')
+        ds = self.datasources.get(ds_config_section, None)
+        if ds is None:
+            return None
+        return ds.get_deleted_rows(src_metadata['source_name'])
+
+
     '''
         Function that archives the file specified by the job metadata_id
 
@@ -174,7 +254,10 @@ class DsMetadataBase(DsBase):
 
 
 '''
-    Class for processing file based metadata
+    Class for processing file based metadata. Metadata files are indexed on
+    (mtime, size), so only new or changed files are read each cycle. Only
+    the metadata of READY and in progress jobs is kept in memory, READY ids
+    are queued as they are found.
 '''
 class DsMetadataFile(DsMetadataBase):
     def __init__(self, config):
@@ -182,22 +265,37 @@ class DsMetadataFile(DsMetadataBase):
         self.metadata_location = config['DsMetadataFile']['MetadataLocation']
         self.file_pattern = config['DsMetadataFile']['FilePattern']
 
+        # (mtime, size) of the metadata files read, keyed on path
+        self.file_index = {}
+        self.ready_ids = deque()
+
 
     '''
-        Function that traverse a directory and returns a list of metadata files.
+        Function that traverse a directory and returns the metadata files.
 
         Params:
 
         Returns:
-            list of files matching self.file_pattern 
+            dict of (mtime, size) of files matching self.file_pattern keyed on path
     '''
     def get_metadata_files(self):
-        dirpath = self.metadata_location
-        return [f for d in os.walk(dirpath) for f in glob(os.path.join(d[0], self.file_pattern))]
+        mfiles = {}
+        for dirpath, _, filenames in os.walk(self.metadata_location):
+            for name in sorted(filenames):
+                if not fnmatch(name, self.file_pattern):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                mfiles[path] = (stat.st_mtime_ns, stat.st_size)
+        return mfiles
 
 
     '''
-        Function that traverse a directory and returns a list of metadata.
+        Function that traverse a directory and reads the new and changed
+        metadata files, queueing the ids of READY metadata.
 
         Params:
 
@@ -207,22 +305,72 @@ class DsMetadataFile(DsMetadataBase):
     def get_source_metadata(self):
 
         mfiles = self.get_metadata_files()
-        for mf in mfiles:
-            with open(mf) as f:
-                jdata = json.load(f)
-                jdata['__path'] = mf
-                self.source_metadata[jdata['id']] = jdata
+        for mf, key in mfiles.items():
+            if self.file_index.get(mf) == key:
+                continue
+
+            try:
+                with open(mf) as f:
+                    jdata = json.load(f)
+            except (OSError, ValueError) as e:
+                # possibly being written, read again next cycle
+                logger.warning('Failed to read metadata file "{}" due to error {}'.format(mf, e))
+                continue
+
+            self.file_index[mf] = key
+            jdata['__path'] = mf
+            md_id = jdata['id']
+            if jdata['status'].upper() == 'READY':
+                if md_id not in self.source_metadata or self.source_metadata[md_id]['status'].upper() != 'READY':
+                    self.ready_ids.append(md_id)
+                self.source_metadata[md_id] = jdata
+            elif jdata['status'].upper() in ('COMPLETE', 'FAIL'):
+                self.source_metadata.pop(md_id, None)
+
+        # files removed
+        for mf in self.file_index.keys() - mfiles.keys():
+            del self.file_index[mf]
 
         return self.source_metadata
 
 
     '''
-        Function that is essentially alias of get_data_files()
+        Function that returns the ids of the metadata that became READY
+        since the last call
     '''
     def get_data_units(self):
         self.get_source_metadata()
-        
-        return self.get_metadata_id_for_status(status='READY')
+
+        ids = []
+        while self.ready_ids:
+            md_id = self.ready_ids.popleft()
+            md = self.source_metadata.get(md_id, None)
+            if md is not None and md['status'].upper() == 'READY' and md_id not in ids:
+                ids.append(md_id)
+        return ids
+
+
+    '''
+        Function that archives the file specified by the job metadata_id,
+        and evicts its metadata from memory. If archiving fails the metadata
+        file is read again next cycle, as its status may not have been saved.
+
+        Params:
+            mda_id: metadata id
+    '''
+    def archive_data(self, mda_id, done=True):
+        if mda_id not in self.source_metadata:
+            # evicted by a failed archive, it is read again next cycle
+            logger.warning('Metadata "{}" is not archived, it is read again'.format(mda_id))
+            return
+        try:
+            super().archive_data(mda_id, done=done)
+        except Exception as e:
+            path = self.source_metadata.get(mda_id, {}).get('__path', None)
+            self.file_index.pop(path, None)
+            raise e
+        finally:
+            self.source_metadata.pop(mda_id, None)
 
 
     '''
@@ -235,10 +383,16 @@ class DsMetadataFile(DsMetadataBase):
     def save_metadata(self, path, mda):
         with open(path, 'w') as out:
             json.dump(mda, out)
+        # own updates are not read back
+        stat = os.stat(path)
+        self.file_index[path] = (stat.st_mtime_ns, stat.st_size)
 
 
 '''
-    Class for processing Zookeeper based metadata
+    Class for processing Zookeeper based metadata. The znodes under the base
+    znode are kept in a TreeCache, which watches them and reads only the
+    znodes that change, asynchronously. Metadata that becomes READY is
+    queued and wakes the driver waiting for data.
 '''
 class DsMetadataZookeeper(DsMetadataBase):
     def __init__(self, config):
@@ -262,40 +416,72 @@ class DsMetadataZookeeper(DsMetadataBase):
 
         self.zookeeper.start()
         self.file_pattern = config['DsMetadataZookeeper']['FilePattern']
+        self.init_timeout = float(config['DsMetadataZookeeper']['InitTimeout'] or 30)
 
+        # cache state is updated from the kazoo event thread
+        self.lock = threading.Lock()
+        self.ready_ids = deque()
+        self.data_ready = threading.Event()
+        self.initialized = threading.Event()
+        # metadata ids keyed on znode, and ids handed to the driver and not yet archived
+        self.znode_ids = {}
+        self.in_progress = set()
 
-    '''
-        Function to return all children znodes given the parent znode
+        self.tree = TreeCache(self.zookeeper, self.base_znode)
+        self.tree.listen(self.on_tree_event)
+        self.tree.start()
 
-        Params:
-            parent_znode: parent znode
 
-        Returns:
-            a list of childrn znodes
     '''
-    def get_all_children_znodes(self, parent_znode):
-        nodes = []
-        children = self.zookeeper.get_children(parent_znode)
-        for c in children:
-            child_znode = parent_znode + '/' + c
-            nodes.append(child_znode)
-            nodes.extend(self.get_all_children_znodes(child_znode))
-
-        return nodes
-
+        Function to update the metadata cache on a change of a znode under
+        the base znode
 
+        Params:
+            event: kazoo TreeEvent
     '''
-        Function that traverse znode and returns a list of metadata files.
+    def on_tree_event(self, event):
+        if event.event_type == TreeEvent.INITIALIZED:
+            self.initialized.set()
+            return
+        if event.event_type not in (TreeEvent.NODE_ADDED, TreeEvent.NODE_UPDATED, TreeEvent.NODE_REMOVED):
+            return
 
-        Params:
+        znode = event.event_data.path
+        if znode == self.base_znode or not fnmatch(znode.rsplit('/', 1)[-1], self.file_pattern):
+            return
 
-        Returns:
-            list of metadata znodes
-    '''
-    def get_metadata_nodes(self):
-        znodes = self.get_all_children_znodes(self.base_znode)
+        if event.event_type == TreeEvent.NODE_REMOVED:
+            with self.lock:
+                md_id = self.znode_ids.pop(znode, None)
+                if md_id is not None and md_id not in self.in_progress:
+                    self.source_metadata.pop(md_id, None)
+            return
 
-        return znodes
+        node_data = event.event_data.data
+        if not node_data:
+            return
+        try:
+            jdata = json.loads(node_data)
+            md_id = jdata['id']
+            status = jdata['status'].upper()
+        except (ValueError, KeyError, AttributeError) as e:
+            logger.warning('Failed to read metadata znode "{}" due to error {}'.format(znode, e))
+            return
+        jdata['__path'] = znode
+
+        with self.lock:
+            self.znode_ids[znode] = md_id
+            if md_id in self.in_progress and status != 'READY':
+                # own status updates, the metadata being processed is up to date
+                return
+            if status == 'READY':
+                current = self.source_metadata.get(md_id, None)
+                if current is None or current['status'].upper() != 'READY':
+                    self.ready_ids.append(md_id)
+                    self.data_ready.set()
+                self.source_metadata[md_id] = jdata
+            else:
+                self.source_metadata.pop(md_id, None)
 
 
     '''
@@ -323,7 +509,8 @@ class DsMetadataZookeeper(DsMetadataBase):
 
 
     '''
-        Function that traverse a directory and returns a list of metadata.
+        Function that returns the cached metadata, once the cache has loaded
+        the existing znodes
 
         Params:
 
@@ -331,24 +518,70 @@ class DsMetadataZookeeper(DsMetadataBase):
             dict of source metadata keyed on metadata id
     '''
     def get_source_metadata(self):
-
-        mnodes = self.get_metadata_nodes()
-        for mn in mnodes:
-            node_data, node_stats = self.get(mn)
-            jdata = json.loads(node_data)
-            jdata['__path'] = mn
-            self.source_metadata[jdata['id']] = jdata
+        if not self.initialized.is_set() and not self.initialized.wait(self.init_timeout):
+            logger.warning('Metadata znodes under "{}" not loaded after {} seconds'.format(self.base_znode, self.init_timeout))
 
         return self.source_metadata
 
 
     '''
-        Function that is essentially alias of get_data_files()
+        Function that returns the ids of the metadata that became READY
+        since the last call
     '''
     def get_data_units(self):
         self.get_source_metadata()
-        
-        return self.get_metadata_id_for_status(status='READY')
+
+        ids = []
+        with self.lock:
+            while self.ready_ids:
+                md_id = self.ready_ids.popleft()
+                md = self.source_metadata.get(md_id, None)
+                if md is not None and md['status'].upper() == 'READY' and md_id not in ids:
+                    ids.append(md_id)
+            self.in_progress.update(ids)
+            self.data_ready.clear()
+        return ids
+
+
+    '''
+        Function to wait for metadata to become READY between polling cycles
+
+        Params:
+            timeout: seconds to wait
+
+        Returns:
+            True if metadata became ready before the timeout
+    '''
+    def wait_for_data(self, timeout):
+        return self.data_ready.wait(timeout)
+
+
+    '''
+        Function that archives the data specified by the job metadata_id,
+        and evicts its metadata from memory
+
+        Params:
+            mda_id: metadata id
+    '''
+    def archive_data(self, mda_id, done=True):
+        try:
+            super().archive_data(mda_id, done=done)
+        finally:
+            with self.lock:
+                self.in_progress.discard(mda_id)
+                if self.source_metadata.get(mda_id, {}).get('status', '').upper() != 'READY':
+                    self.source_metadata.pop(mda_id, None)
+
+
+    '''
+        Function to stop watching the znodes and close the datasources the
+        metadata refers to
+    '''
+    def close(self):
+        super().close()
+        self.tree.close()
+        self.zookeeper.stop()
+        self.zookeeper.close()
 
 
     '''
@@ -1,9 +1,67 @@
 from .ds_base import DsBase
 from pymongo import MongoClient
+import bson
+import queue
+import threading
+from datetime import datetime
 import pandas as pd
 from ast import literal_eval
+from concurrent.futures import ThreadPoolExecutor
+
+from twiddlepy.exceptions import SourceDataError
+from twiddlepy.utils import get_path_value, logger
+from twiddlepy.flatten import get_projection
+
+from .watermark_store import WatermarkStore
+
+# clients, and so connection pools, shared by the datasources of the process
+# keyed by server, port and client options
+clients = {}
+clients_lock = threading.Lock()
+
+
+'''
+    Function that returns the client of a server, created on first use and
+    then shared across datasources and polling cycles
+
+    Params:
+        server: mongo host
+        port: mongo port
+        options: MongoClient keyword arguments
+
+    Returns:
+        MongoClient
+'''
+def get_client(server, port, **options):
+    key = (server, port, tuple(sorted(options.items())))
+    with clients_lock:
+        if key not in clients:
+            clients[key] = MongoClient(server, port, **options)
+        return clients[key]
+
+
+'''
+    Function that prefixes the fields of a query, e.g. to match the
+    documents of change stream events
+
+    Params:
+        query: query filter
+        prefix: prefix of the fields
+
+    Returns:
+        query filter
+'''
+def prefix_query(query, prefix):
+    prefixed = {}
+    for k, v in query.items():
+        if k in ('$and', '$or', '$nor'):
+            prefixed[k] = [prefix_query(q, prefix) for q in v]
+        elif k.startswith('$'):
+            raise ValueError('Query operator "{}" is not supported for change streams'.format(k))
+        else:
+            prefixed[prefix + k] = v
+    return prefixed
 
-from twiddlepy.utils import logger
 
 class DsMongo(DsBase):
 
@@ -37,19 +95,496 @@ class DsMongo(DsBase):
         if not self.mongo_username or not self.mongo_password:
             logger.warn("Username and/or password not set, not using authentication")
 
-        self.mongo_client = MongoClient(self.mongo_server, self.mongo_port)
+        # documents fetched per round-trip, and per dataframe
+        self.batch_size = int(ds_config['BatchSize'])
+        self.chunksize = int(ds_config['ChunkSize'])
+
+        self.mongo_client = get_client(self.mongo_server, self.mongo_port, maxPoolSize=int(ds_config['MaxPoolSize']))
+
+        # a collection can be read in Partitions ranges of PartitionField concurrently
+        self.partitions = int(ds_config['Partitions']) if ds_config['Partitions'] != '' else 1
+        self.partition_field = ds_config['PartitionField'] or '_id'
+        self.partition_method = ds_config['PartitionMethod'].lower()
+        if self.partition_method not in ('sample', 'minmax'):
+            raise ValueError('Unrecognised PartitionMethod "{}"'.format(ds_config['PartitionMethod']))
+        self.partition_ordered = ds_config['PartitionOrdered'].lower() == 'true'
+
+        # incremental reads of documents after the WatermarkField value of the
+        # last document read, and/or changes tailed from a change stream
+        self.watermark_field = ds_config['WatermarkField']
+        # a watermark committed per chunk must be unique, the next chunk could start
+        # with documents sharing the last value. Otherwise it is committed per collection
+        self.watermark_unique = self.watermark_field == '_id' or ds_config['WatermarkUnique'].lower() == 'true'
+        self.change_stream = ds_config['ChangeStream'].lower() == 'true'
+        self.reset_watermark = ds_config['ResetWatermark'].lower() == 'true'
 
+        self.watermark_key = '{}.{}'.format(self.mongo_database, self.mongo_collection)
+        self.resume_token_key = self.watermark_key + '#resume_token'
+        self.watermarks = {}
+        # watermark and resume token of documents read but not yet committed to the repository
+        self.pending_watermarks = {}
+        self.deleted_ids = {}
+        # operation time the change stream of a full read is opened at
+        self.stream_start = None
+
+        self.watermark_store = None
+        if ds_config['WatermarkStore'] and (self.watermark_field or self.change_stream):
+            try:
+                self.watermark_store = WatermarkStore(ds_config['WatermarkStore'], self.ds_config_section)
+                if self.reset_watermark:
+                    self.watermark_store.reset()
+                else:
+                    self.watermarks = self.watermark_store.load()
+            except Exception as e:
+                logger.warning('Failed to read watermark store "{}"'.format(ds_config['WatermarkStore']))
+                raise e
+
+    '''
+        Function that returns a dataframe generator for the collection
+
+        Params:
+            tablename: name of the collection
+            dtype: dictionary specifying column data types 
+    '''
     def read_data_to_df(self, tablename, dtype=None):
         database = self.mongo_client[self.mongo_database]
         collection = database[self.mongo_collection]
 
-        documents = collection.find(self.mongo_query)
+        fields = self.get_source_fields()
+        if fields is not None and self.watermark_field:
+            fields = fields + [self.watermark_field]
+        projection = get_projection(fields) if fields is not None else None
+
+        if self.change_stream and self.resume_token_key in self.watermarks:
+            return self.read_changes(collection, projection)
+
+        stream = None
+        if self.change_stream:
+            # opened before the collection is read, so changes made while
+            # it is read are read from the stream next
+            self.stream_start = self.get_operation_time()
+            stream = self.open_change_stream(collection, projection, self.stream_start)
+
+        query = self.mongo_query
+        sort = None
+        if self.watermark_field:
+            sort = [(self.watermark_field, 1)]
+            wm = self.watermarks.get(self.watermark_key, None)
+            if wm is not None:
+                query = {'$and': [query, {self.watermark_field: {'$gt': wm}}]}
+
+        if self.partitions > 1:
+            return self.read_partitions(collection, query, projection, sort=sort, stream=stream)
+
+        return self.read_chunks(collection, query, projection, sort=sort, stream=stream)
+
+    '''
+        Function that returns a dataframe generator for a query, of ChunkSize
+        documents each. A unique watermark is committed once a chunk has been
+        committed to the repository, i.e. when the next chunk is requested,
+        otherwise once the collection is archived.
+
+        Params:
+            collection: mongo collection
+            query: query filter
+            projection: fields to return, None for all fields
+            sort: list of (field, direction) to sort on, the watermark field when incremental
+            stream: change stream opened before the query, its resume token is committed with the data unit
+    '''
+    def read_chunks(self, collection, query, projection, sort=None, stream=None):
+        logger.info('Reading collection {}'.format(collection.name))
+
+        try:
+            for docs in self.find_chunks(collection, query, projection, sort):
+                yield pd.DataFrame(docs)
+                self.advance_watermark(docs[-1])
+                if self.watermark_unique:
+                    self.commit_watermark()
+
+            if stream is not None:
+                self.save_resume_point(stream, self.stream_start)
+        except Exception as e:
+            logger.error('Failed to read collection "{}" due to error {}'.format(collection.name, e))
+            raise SourceDataError('Failed to read collection "{}"'.format(collection.name))
+        finally:
+            if stream is not None:
+                stream.close()
+
+    '''
+        Function that returns a generator of lists of ChunkSize documents for a
+        query, fetched from the server in batches of BatchSize documents
+
+        Params:
+            collection: mongo collection
+            query: query filter
+            projection: fields to return, None for all fields
+            sort: list of (field, direction) to sort on
+
+        Returns:
+            generator of lists of documents
+    '''
+    def find_chunks(self, collection, query, projection, sort=None):
+        cursor = collection.find(query, projection, sort=sort, batch_size=self.batch_size)
+        docs = []
+        try:
+            for doc in cursor:
+                docs.append(doc)
+                if len(docs) >= self.chunksize:
+                    yield docs
+                    docs = []
+            if docs:
+                yield docs
+        finally:
+            cursor.close()
+
+    '''
+        Function that reads a collection in ranges of the partition field, over
+        concurrent cursors. Each range is read by a thread into a bounded queue
+        of chunks, the chunks are yielded in range order if PartitionOrdered,
+        otherwise as they are read.
+
+        Params:
+            collection: mongo collection
+            query: query filter
+            projection: fields to return, None for all fields
+            sort: list of (field, direction) to sort on
+            stream: change stream opened before the query
+
+        Returns:
+            generator of dataframes
+    '''
+    def read_partitions(self, collection, query, projection, sort=None, stream=None):
+        try:
+            edges = self.get_partition_edges(collection, query)
+        except Exception as e:
+            logger.error('Failed to partition collection "{}" due to error {}'.format(collection.name, e))
+            raise SourceDataError('Failed to read collection "{}"'.format(collection.name))
+
+        f = self.partition_field
+        ranges = []
+        for i in range(len(edges) + 1):
+            bounds = {}
+            if i > 0:
+                bounds['$gt'] = edges[i-1]
+            if i < len(edges):
+                bounds['$lte'] = edges[i]
+            if not bounds:
+                ranges.append(query)
+            elif i == 0:
+                # documents without a partition value are read with the first range
+                ranges.append({'$and': [query, {'$or': [{f: bounds}, {f: None}]}]})
+            else:
+                ranges.append({'$and': [query, {f: bounds}]})
+
+        logger.info('Reading collection {} in {} partitions'.format(collection.name, len(ranges)))
+
+        # the watermark is committed per chunk only if ranges are in watermark order
+        commit_per_chunk = self.partition_ordered and self.partition_field == self.watermark_field and self.watermark_unique
+        if self.partition_ordered:
+            queues = [queue.Queue(2) for _ in ranges]
+        else:
+            queues = [queue.Queue(2 * len(ranges))] * len(ranges)
+        stopped = threading.Event()
+
+        def put(q, item):
+            while not stopped.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
 
-        df = pd.DataFrame.from_dict(documents)
-        logger.debug(df)
+        def read_range(i):
+            chunks = self.find_chunks(collection, ranges[i], projection, sort)
+            try:
+                for docs in chunks:
+                    if not put(queues[i], docs):
+                        return
+                put(queues[i], None)
+            except Exception as e:
+                put(queues[i], e)
+            finally:
+                chunks.close()
 
+        last_docs = []
+        pool = ThreadPoolExecutor(max_workers=len(ranges))
+        try:
+            for i in range(len(ranges)):
+                pool.submit(read_range, i)
+
+            remaining = len(ranges)
+            i = 0
+            while remaining > 0:
+                docs = queues[i].get()
+                if isinstance(docs, Exception):
+                    raise docs
+                if docs is None:
+                    remaining -= 1
+                    if self.partition_ordered:
+                        i += 1
+                    continue
+
+                yield pd.DataFrame(docs)
+                if commit_per_chunk:
+                    self.advance_watermark(docs[-1])
+                    self.commit_watermark()
+                else:
+                    last_docs.append(docs[-1])
+
+            # ranges are read in watermark order, the latest watermark is the max
+            if self.watermark_field and last_docs:
+                wms = [d for d in last_docs if get_path_value(d, self.watermark_field.split('.')) is not None]
+                if wms:
+                    self.advance_watermark(max(wms, key=lambda d: get_path_value(d, self.watermark_field.split('.'))))
+
+            if stream is not None:
+                self.save_resume_point(stream, self.stream_start)
+        except Exception as e:
+            logger.error('Failed to read collection "{}" due to error {}'.format(collection.name, e))
+            raise SourceDataError('Failed to read collection "{}"'.format(collection.name))
+        finally:
+            stopped.set()
+            pool.shutdown(wait=True)
+            if stream is not None:
+                stream.close()
+
+    '''
+        Function that returns the boundaries splitting a collection into
+        partitions, the quantiles of a random sample of the partition field,
+        or interpolated between its min and max
+
+        Params:
+            collection: mongo collection
+            query: query filter
+
+        Returns:
+            ascending list of the upper (inclusive) bound of each partition but the last
+    '''
+    def get_partition_edges(self, collection, query):
+        f = self.partition_field
+        n = self.partitions
+        path = f.split('.')
+
+        if self.partition_method == 'sample':
+            return self.get_sample_edges(collection, query)
+        else:
+            not_null = {'$and': [query, {f: {'$ne': None}}]}
+            lo = collection.find_one(not_null, {f: 1}, sort=[(f, 1)])
+            hi = collection.find_one(not_null, {f: 1}, sort=[(f, -1)])
+            if lo is None or hi is None:
+                return []
+            lo = get_path_value(lo, path)
+            hi = get_path_value(hi, path)
+            if isinstance(lo, bson.ObjectId):
+                lo = int(str(lo), 16)
+                hi = int(str(hi), 16)
+                edges = [bson.ObjectId('{:024x}'.format(lo + (hi - lo) * i // n)) for i in range(1, n)]
+            elif isinstance(lo, datetime):
+                edges = [lo + (hi - lo) * i / n for i in range(1, n)]
+            elif isinstance(lo, int):
+                edges = [lo + (hi - lo) * i // n for i in range(1, n)]
+            elif isinstance(lo, float):
+                edges = [lo + (hi - lo) * i / n for i in range(1, n)]
+            else:
+                logger.info('Partition field "{}" is not an ObjectId, number or date, using a sample'.format(f))
+                return self.get_sample_edges(collection, query)
+
+        return sorted(set(edges))
+
+    '''
+        Function that returns the quantiles of a random sample of the partition field
+
+        Params:
+            collection: mongo collection
+            query: query filter
+
+        Returns:
+            ascending list of the upper (inclusive) bound of each partition but the last
+    '''
+    def get_sample_edges(self, collection, query):
+        f = self.partition_field
+        n = self.partitions
+        path = f.split('.')
+
+        pipeline = [{'$match': query}] if query else []
+        pipeline += [{'$sample': {'size': n * 100}}, {'$project': {f: 1}}]
+        values = sorted(v for v in (get_path_value(d, path) for d in collection.aggregate(pipeline, allowDiskUse=True)) if v is not None)
+        if not values:
+            return []
+        return sorted(set(values[len(values) * i // n] for i in range(1, n)))
+
+    '''
+        Function that returns a dataframe generator of the documents inserted,
+        updated or replaced since the stored resume token, read without waiting
+        for changes not yet made. Deleted document ids are returned by
+        get_deleted_rows.
+
+        Params:
+            collection: mongo collection
+            projection: fields to return, None for all fields
+    '''
+    def read_changes(self, collection, projection):
+        logger.info('Reading changes of collection {}'.format(collection.name))
+
+        resume_point = self.watermarks[self.resume_token_key]
+        stream = self.open_change_stream(collection, projection, resume_point)
+        docs = []
+        try:
+            while True:
+                change = stream.try_next()
+                if change is None:
+                    break
+
+                doc_id = change['documentKey']['_id']
+                if change['operationType'] == 'delete':
+                    self.deleted_ids[str(doc_id)] = doc_id
+                elif change.get('fullDocument') is not None:
+                    # a document deleted and inserted again is not deleted
+                    self.deleted_ids.pop(str(doc_id), None)
+                    docs.append(change['fullDocument'])
+
+                if len(docs) >= self.chunksize:
+                    yield pd.DataFrame(docs)
+                    docs = []
+            if docs:
+                yield pd.DataFrame(docs)
+
+            self.save_resume_point(stream, resume_point)
+        except Exception as e:
+            logger.error('Failed to read changes of collection "{}" due to error {}'.format(collection.name, e))
+            raise SourceDataError('Failed to read collection "{}"'.format(collection.name))
+        finally:
+            stream.close()
+
+    '''
+        Function that opens a change stream of the inserts, updates, replaces
+        and deletes of the documents of a collection matching MongoQuery
+
+        Params:
+            collection: mongo collection
+            projection: fields to return, None for all fields
+            resume_point: token to resume the stream after, or operation time
+                to start it at, None to start from now
+
+        Returns:
+            change stream
+    '''
+    def open_change_stream(self, collection, projection, resume_point):
+        match = {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}
+        if self.mongo_query:
+            # deletes have no document to match
+            match = {'$or': [{'operationType': 'delete'},
+                             {'$and': [match, prefix_query(self.mongo_query, 'fullDocument.')]}]}
+        pipeline = [{'$match': match}]
+        if projection is not None:
+            fields = {'fullDocument.' + f: 1 for f in projection}
+            fields.update({'operationType': 1, 'documentKey': 1})
+            pipeline.append({'$project': fields})
+
+        if isinstance(resume_point, bson.Timestamp):
+            return collection.watch(pipeline, full_document='updateLookup', start_at_operation_time=resume_point)
+        return collection.watch(pipeline, full_document='updateLookup', resume_after=resume_point)
+
+    '''
+        Function that returns the current operation time of the cluster, the
+        point change streams are started at before a collection is read
+
+        Returns:
+            bson Timestamp, None if the server does not report it
+    '''
+    def get_operation_time(self):
+        try:
+            with self.mongo_client.start_session() as session:
+                self.mongo_client.admin.command('ping', session=session)
+                return session.operation_time
+        except Exception as e:
+            logger.warning('Failed to read the operation time due to error {}'.format(e))
+            return None
+
+    '''
+        Function that records the point to resume a change stream from, once
+        its changes are committed. Streams not iterated have no resume token
+        on servers before 4.0.7, the previous point is then kept.
+
+        Params:
+            stream: change stream
+            previous: point the stream was opened at
+    '''
+    def save_resume_point(self, stream, previous):
+        resume_point = stream.resume_token if stream.resume_token is not None else previous
+        if resume_point is None:
+            logger.warning('Change stream of collection "{}" has no resume point, it is read in full again'.format(self.mongo_collection))
+            return
+        self.pending_watermarks[self.resume_token_key] = resume_point
+
+    '''
+        Function that records the watermark of the last document read, to be
+        committed once the documents are committed to the repository
+
+        Params:
+            doc: last document read
+    '''
+    def advance_watermark(self, doc):
+        if not self.watermark_field:
+            return
+        wm = get_path_value(doc, self.watermark_field.split('.'))
+        if wm is not None:
+            self.pending_watermarks[self.watermark_key] = wm
+
+    '''
+        Function that commits the pending watermark, the resume token is
+        committed when the collection is archived
+    '''
+    def commit_watermark(self):
+        wm = self.pending_watermarks.pop(self.watermark_key, None)
+        if wm is not None:
+            self.watermarks[self.watermark_key] = wm
+            if self.watermark_store is not None:
+                self.watermark_store.save({self.watermark_key: wm})
+
+    '''
+        Function that returns the ids of the documents deleted from the collection
+
+        Params:
+            tablename: name of the collection
+
+        Returns:
+            dataframe of the _id of deleted documents, None if there are none
+    '''
+    def get_deleted_rows(self, tablename):
+        if not self.deleted_ids:
+            return None
+        df = pd.DataFrame({'_id': list(self.deleted_ids.values())})
+        self.deleted_ids = {}
         return df
 
+    '''
+        Function that commits the watermark and change stream resume token
+        once the documents have been committed to the repository, or discards
+        them if they failed
+
+        Params:
+            tablename: name of the collection
+            done: if the collection has been successfully processed.
+    '''
+    def archive_data(self, tablename, done=True):
+        if done and self.pending_watermarks:
+            self.watermarks.update(self.pending_watermarks)
+            if self.watermark_store is not None:
+                self.watermark_store.save(self.pending_watermarks)
+        elif not done:
+            self.deleted_ids = {}
+        self.pending_watermarks = {}
+
+    '''
+        Function to close the watermark store
+    '''
+    def close(self):
+        if self.watermark_store is not None:
+            self.watermark_store.close()
+            self.watermark_store = None
+
     def get_data_units(self):
         return [self.mongo_collection]
 
@@ -1,15 +1,118 @@
 import os
-import pickle
+import json
+from datetime import datetime
+from decimal import Decimal
 from glob import glob
+from urllib.parse import quote
+import numpy as np
 import pandas as pd
 import re
-from sqlalchemy import create_engine
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import __version__ as sa_version, and_, bindparam, create_engine, func, inspect, literal_column, or_, select, text
+from sqlalchemy.sql import column, quoted_name, table
 import cx_Oracle
 
+try:
+    from psycopg2.extensions import encodings as pg_encodings
+    has_psycopg2 = True
+except ImportError:
+    has_psycopg2 = False
+
 from twiddlepy.exceptions import SourceDataError
 from twiddlepy.utils import logger, uppercase
 
 from .ds_base import DsBase
+from .watermark_store import WatermarkStore
+
+
+# postgres type oids of the columns converted from COPY text, other types are kept as text
+pg_int_types = {20, 21, 23}
+pg_float_types = {700, 701}
+pg_numeric_type = 1700
+pg_bool_type = 16
+pg_datetime_types = {1082, 1114, 1184}
+
+# engines, and so connection pools, shared by the datasources of the process
+# keyed by database url and engine options
+engines = {}
+engines_lock = threading.Lock()
+
+
+'''
+    Function that returns the engine of a database url, created on first use
+    and then shared across datasources, metadata jobs and polling cycles.
+
+    Params:
+        dburl: database url
+        options: create_engine keyword arguments
+
+    Returns:
+        sqlalchemy engine
+'''
+def get_engine(dburl, **options):
+    key = (dburl, tuple(sorted(options.items())))
+    with engines_lock:
+        if key not in engines:
+            engines[key] = create_engine(dburl, **options)
+        return engines[key]
+
+
+# select() takes a list of columns before SQLAlchemy 1.4
+select_takes_list = tuple(int(v) for v in sa_version.split('.')[:2]) < (1, 4)
+
+# change capture trigger events, with the rows whose key is logged and their changelog op.
+# Updates log the old key as deleted first, so a key change deletes the old row.
+change_capture_events = (('INSERT', [('NEW', 'I')]), ('UPDATE', [('OLD', 'D'), ('NEW', 'U')]), ('DELETE', [('OLD', 'D')]))
+
+
+'''
+    Function that returns a select of columns, for any SQLAlchemy version
+
+    Params:
+        columns: list of column elements
+
+    Returns:
+        sqlalchemy select
+'''
+def sql_select(columns):
+    return select(columns) if select_takes_list else select(*columns)
+
+
+'''
+    Function that returns a table or column name to be rendered as it is
+    configured, without quoting, so that names keep the database case rules.
+
+    Params:
+        name: table or column name
+
+    Returns:
+        sqlalchemy quoted_name
+'''
+def sql_name(name):
+    return quoted_name(name, False)
+
+
+'''
+    Function that converts numpy and pandas scalars to native python values,
+    as expected by the database drivers for bind parameters.
+
+    Params:
+        value: scalar value
+
+    Returns:
+        python value
+'''
+def native_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.datetime64):
+        return pd.Timestamp(value).to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
 
 '''
     Class for Sql based data sources, direct sub class 
@@ -17,6 +120,9 @@ from .ds_base import DsBase
 '''
 class DsDatabaseBase(DsBase):
 
+    # if change capture triggers are implemented for the database
+    supports_change_capture = False
+
     '''
         Class function to add a table column to a dataframe
 
@@ -40,35 +146,122 @@ class DsDatabaseBase(DsBase):
 
         ds_config = config[self.ds_config_section]
 
+        # regular expression of the tables to use, compiled when tables are listed
         self.table_pattern = ds_config['TablePattern']
+        self.table_regex = None
+
+        # tables are listed again after TableListTTL seconds, or when the catalog changes
+        self.table_list_ttl = float(ds_config['TableListTTL']) if ds_config['TableListTTL'] != '' else 0
+        self.table_list = None
+        self.table_list_time = 0
+        self.catalog_version = None
 
         self.select_columns = ds_config['TableColumns'].split()
 
         self.db_engine = None
 
+        # connection pool options of the engine
+        self.engine_options = {
+            'pool_pre_ping': ds_config['PoolPrePing'].lower() == 'true',
+            'pool_recycle': int(ds_config['PoolRecycle'])
+        }
+        # file sqlite databases are not pooled
+        if ds_type != 'database.sqlite':
+            self.engine_options['pool_size'] = int(ds_config['PoolSize'])
+            self.engine_options['max_overflow'] = int(ds_config['MaxOverflow'])
+
         if ds_type != 'database.sqlite':
             self.db_server = ds_config['DbServer']
             self.db_name = ds_config['DbName']
             self.db_username = ds_config['DbUsername']
             self.db_password = ds_config['DbPassword']
 
-        self.watermark_column = ds_config['WatermarkColumn']
-        self.watermark_store = ds_config['WatermarkStore']
+        # rows are streamed from a server-side cursor in chunks of ChunkSize rows,
+        # empty to read a table in one go
+        self.chunksize = int(ds_config['ChunkSize']) if ds_config['ChunkSize'] != '' else None
+
+        # a composite watermark is a space separated list of columns, e.g. a
+        # modification time and the primary key, compared as a tuple
+        self.watermark_columns = ds_config['WatermarkColumn'].split()
+        self.watermark_column = self.watermark_columns[0] if self.watermark_columns else ''
+
+        # a composite watermark is unique, a single column only if WatermarkUnique. Pages
+        # and commits ending within rows sharing a value would skip the rest of them
+        self.watermark_unique = len(self.watermark_columns) > 1 or ds_config['WatermarkUnique'].lower() == 'true'
+
+        # incremental reads are paged by the watermark (keyset pagination) in batches of BatchSize rows
+        self.batch_size = int(ds_config['BatchSize']) if ds_config['BatchSize'] != '' else None
+        if self.batch_size is not None and self.watermark_column and not self.watermark_unique:
+            raise ValueError('BatchSize requires a unique watermark, add the primary key to WatermarkColumn or set WatermarkUnique')
+
+        # a table can be read in Partitions ranges of PartitionColumn concurrently
+        self.partitions = int(ds_config['Partitions']) if ds_config['Partitions'] != '' else 1
+        self.partition_column = ds_config['PartitionColumn'] or self.watermark_column
+        self.partition_method = ds_config['PartitionMethod'].lower()
+        if self.partition_method not in ('minmax', 'quantile'):
+            raise ValueError('Unrecognised PartitionMethod "{}"'.format(ds_config['PartitionMethod']))
+        self.partition_ordered = ds_config['PartitionOrdered'].lower() == 'true'
+
         if ds_config['ResetWatermark'].lower() == 'true':
             self.reset_watermark = True
         else:
             self.reset_watermark = False
 
+        # change capture: triggers log the primary key of changed rows to a changelog
+        # table, the watermark of a table is then the last changelog sequence read
+        self.change_capture = ds_config['ChangeCapture'].lower() == 'true'
+        if self.change_capture:
+            if not self.supports_change_capture:
+                raise ValueError('ChangeCapture is not supported for {}'.format(self.ds_config_section))
+            if self.watermark_column:
+                raise ValueError('ChangeCapture and WatermarkColumn cannot both be specified')
+        self.primary_key = ds_config['PrimaryKey'].split()
+        self.changelog_table = ds_config['ChangeLogTable']
+        self.changelog_batch_size = int(ds_config['ChangeLogBatchSize'])
+        self.captured_tables = set()
+        self.primary_keys = {}
+        self.deleted_rows = {}
+
         self.watermarks = {}
+        # column names keyed by table, read again after TableListTTL seconds
+        self.table_columns = {}
+        self.table_columns_time = {}
+
+        # select statements keyed by table, reused across polling cycles with
+        # the watermark and partition bounds as bind parameters
+        self.statements = {}
 
-        if self.watermark_store and not self.reset_watermark:
+        # watermarks of rows read but not yet committed to the repository
+        self.pending_watermarks = {}
+
+        self.watermark_store = None
+        if ds_config['WatermarkStore']:
             try:
-                if os.path.isfile(self.watermark_store) and os.path.getsize(self.watermark_store) > 0:      
-                    with open(self.watermark_store, 'rb') as wmstore:
-                        self.watermarks = pickle.load(wmstore)
+                self.watermark_store = WatermarkStore(ds_config['WatermarkStore'], self.ds_config_section)
+                if self.reset_watermark:
+                    self.watermark_store.reset()
+                else:
+                    self.watermarks = self.watermark_store.load()
             except Exception as e:
-                logger.warning('Failed to read watermark store "{}"'.format(self.watermark_store))
+                logger.warning('Failed to read watermark store "{}"'.format(ds_config['WatermarkStore']))
                 raise e
+            self.reset_mismatched_watermarks()
+
+
+    '''
+        Function that resets the stored watermarks that do not have a value
+        for each WatermarkColumn, e.g. scalar watermarks stored before the
+        watermark became composite. Their tables are read in full again.
+    '''
+    def reset_mismatched_watermarks(self):
+        if not self.watermark_columns:
+            return
+        for tablename, wm in list(self.watermarks.items()):
+            values = wm if isinstance(wm, tuple) else (wm,)
+            if len(values) != len(self.watermark_columns):
+                logger.warning('Watermark {} of table "{}" does not match WatermarkColumn "{}", reading the table in full'.format(
+                                wm, tablename, ' '.join(self.watermark_columns)))
+                del self.watermarks[tablename]
 
 
     '''
@@ -79,50 +272,624 @@ class DsDatabaseBase(DsBase):
     '''
     def read_data_to_df(self, tablename, dtype=None):
         logger.info('Reading table {}'.format(tablename))
+        self.expire_table_columns(tablename)
 
-        if self.select_columns:
-            columns = self.select_columns[:]
-            if self.watermark_column and self.watermark_column not in columns:
-                columns.append(self.watermark_column)
-            query = 'select {c} from {t}'.format(c=','.join(columns), t=tablename)
-        else:
-            query = 'select * from {t}'.format(t=tablename)
-
-        if self.watermark_column:
-            wm = self.watermarks.get(tablename, None)
-                    
-            if wm is not None:
-                if pd.api.types.is_number(wm):
-                    sql = "{q} where {c} > {w} order by {c} asc".format(q=query, c=self.watermark_column, w=wm)
-                else:
-                    sql = "{q} where {c} > '{w}' order by {c} asc".format(q=query, c=self.watermark_column, w=wm)
-            else:
-                sql = '{q} order by {c} asc'.format(q=query, c=self.watermark_column)
-        else:
-            sql = query
+        if self.change_capture:
+            try:
+                seq = self.start_change_capture(tablename)
+            except Exception as e:
+                logger.error('Failed to capture changes of table "{}" due to error {}'.format(tablename, e))
+                raise SourceDataError('Failed to read table "{}"'.format(tablename))
+            if seq is not None:
+                return self.read_changes(tablename, seq)
+
+        wm = self.watermarks.get(tablename, None) if self.watermark_column else None
+
+        try:
+            params = self.get_watermark_params(wm)
+            stmt = self.get_select_statement(tablename, incremental=wm is not None)
+        except Exception as e:
+            logger.error('Failed to read table "{}" due to error {}'.format(tablename, e))
+            raise SourceDataError('Failed to read table "{}"'.format(tablename))
+
+        if self.partitions > 1 and self.partition_column:
+            return self.read_partitions(tablename, wm is not None, params)
+
+        if self.batch_size is not None and self.watermark_column:
+            return self.read_batches(tablename, wm)
+
+        if self.chunksize is not None:
+            return self.read_chunks(tablename, stmt, params)
 
         try:
-            df = self.run_query(sql)
+            df = self.run_query(stmt, params=params)
             
             if len(df.index)>0:
                 if self.watermark_column:
-                    self.watermarks[tablename] = df.iloc[-1][self.watermark_column]
+                    self.advance_watermark(tablename, self.get_row_watermark(df))
 
         except Exception as e:
             logger.error('Failed to read table "{}" due to error {}'.format(tablename, e))
             raise SourceDataError('Failed to read table "{}"'.format(tablename))
 
         return df
+
+
+    '''
+        Function that returns the select statement of a table. Statements are
+        built once per table, the watermark columns are bind parameters named
+        watermark_<n> and partition bounds are bind parameters named lower and upper.
+
+        Params:
+            tablename: name of the table
+            incremental: if rows are selected from after the watermark
+            lower: if rows are selected from after a lower partition bound
+            upper: if rows are selected up to an upper partition bound
+            limit: maximum number of rows selected
+
+        Returns:
+            sqlalchemy select
+    '''
+    def get_select_statement(self, tablename, incremental=False, lower=False, upper=False, limit=None):
+        key = (tablename, incremental, lower, upper, limit)
+        if key not in self.statements:
+            columns = self.get_select_columns(tablename)
+            if columns:
+                columns = [column(sql_name(c)) for c in columns]
+            else:
+                columns = [literal_column('*')]
+            stmt = sql_select(columns).select_from(self.get_table_clause(tablename))
+
+            if self.watermark_column:
+                if incremental:
+                    stmt = stmt.where(self.get_watermark_condition())
+                stmt = stmt.order_by(*[column(sql_name(c)).asc() for c in self.watermark_columns])
+
+            if lower or upper:
+                pc = column(sql_name(self.partition_column))
+                if lower:
+                    stmt = stmt.where(pc > bindparam('lower'))
+                if upper:
+                    # rows without a partition value are read with the first range
+                    stmt = stmt.where(pc <= bindparam('upper') if lower else or_(pc <= bindparam('upper'), pc.is_(None)))
+
+            if limit is not None:
+                stmt = stmt.limit(limit)
+
+            self.statements[key] = stmt
+        return self.statements[key]
+
+
+    '''
+        Function that returns the condition selecting rows after the watermark.
+        A composite watermark (c1, c2, ...) > (w1, w2, ...) is expanded to
+        c1 >= w1 and (c1 > w1 or (c1 = w1 and c2 > w2) or ...), as row value
+        comparisons are not supported by every database, the leading c1 >= w1
+        lets the database use an index on the watermark columns.
+
+        Returns:
+            sqlalchemy condition
+    '''
+    def get_watermark_condition(self):
+        columns = [column(sql_name(c)) for c in self.watermark_columns]
+        params = [bindparam('watermark_{}'.format(i)) for i in range(len(columns))]
+        if len(columns) == 1:
+            return columns[0] > params[0]
+
+        terms = []
+        for i in range(len(columns)):
+            terms.append(and_(*([c == p for c, p in zip(columns[:i], params[:i])] + [columns[i] > params[i]])))
+        return and_(columns[0] >= params[0], or_(*terms))
+
+
+    '''
+        Function that returns the bind parameters of a watermark
+
+        Params:
+            wm: watermark, a tuple for a composite watermark
+
+        Returns:
+            dict of bind parameters
+    '''
+    def get_watermark_params(self, wm):
+        if wm is None:
+            return {}
+        values = wm if isinstance(wm, tuple) else (wm,)
+        if len(values) != len(self.watermark_columns):
+            raise ValueError('Watermark {} does not match WatermarkColumn "{}"'.format(wm, ' '.join(self.watermark_columns)))
+        return {'watermark_{}'.format(i): native_value(v) for i, v in enumerate(values)}
+
+
+    '''
+        Function that returns the watermark of the last row of a dataframe
+
+        Params:
+            df: dataframe ordered by the watermark columns
+
+        Returns:
+            watermark value, a tuple for a composite watermark
+    '''
+    def get_row_watermark(self, df):
+        row = df.iloc[-1]
+        values = tuple(native_value(row[uppercase(c)]) for c in self.watermark_columns)
+        return values if len(values) > 1 else values[0]
+
+
+    '''
+        Function that returns a dataframe generator for a table, paged by the
+        watermark in batches of at most BatchSize rows, so that each query uses
+        the watermark index and only one batch is held in memory. The watermark
+        is committed once a batch has been committed to the repository.
+
+        Params:
+            tablename: name of the table
+            wm: watermark to read from, None to read from the start
+
+        Returns:
+            generator of dataframes
+    '''
+    def read_batches(self, tablename, wm):
+        try:
+            while True:
+                stmt = self.get_select_statement(tablename, incremental=wm is not None, limit=self.batch_size)
+                df = self.run_query(stmt, params=self.get_watermark_params(wm))
+                if len(df.index) == 0:
+                    break
+
+                yield df
+
+                wm = self.get_row_watermark(df)
+                self.advance_watermark(tablename, wm)
+                self.commit_watermarks(tablename)
+                if len(df.index) < self.batch_size:
+                    break
+        except Exception as e:
+            logger.error('Failed to read table "{}" due to error {}'.format(tablename, e))
+            raise SourceDataError('Failed to read table "{}"'.format(tablename))
+
+
+    '''
+        Function that returns a dataframe generator for a table query. A unique
+        watermark is committed once a chunk has been committed to the repository,
+        i.e. when the next chunk is requested. Otherwise the next chunk may start
+        with rows sharing the last value, and the watermark is committed when the
+        table is archived.
+
+        Params:
+            tablename: name of the table
+            stmt: select statement
+            params: bind parameters of the statement
+    '''
+    def read_chunks(self, tablename, stmt, params):
+        try:
+            for df in self.run_query(stmt, chunksize=self.chunksize, params=params):
+                yield df
+
+                if self.watermark_column and len(df.index) > 0:
+                    self.advance_watermark(tablename, self.get_row_watermark(df))
+                    if self.watermark_unique:
+                        self.commit_watermarks(tablename)
+        except Exception as e:
+            logger.error('Failed to read table "{}" due to error {}'.format(tablename, e))
+            raise SourceDataError('Failed to read table "{}"'.format(tablename))
     
          
+    '''
+        Function that reads a table in ranges of the partition column, over
+        concurrent connections. The dataframes of the ranges are yielded in
+        range order if PartitionOrdered, otherwise as they are read.
+
+        Params:
+            tablename: name of the table
+            incremental: if rows are selected from after the watermark
+            params: bind parameters of the table select
+
+        Returns:
+            generator of dataframes, one per range
+    '''
+    def read_partitions(self, tablename, incremental, params):
+        try:
+            edges = self.get_partition_edges(tablename, incremental, params)
+        except Exception as e:
+            logger.error('Failed to partition table "{}" due to error {}'.format(tablename, e))
+            raise SourceDataError('Failed to read table "{}"'.format(tablename))
+
+        ranges = []
+        for i in range(len(edges) + 1):
+            range_params = dict(params)
+            if i > 0:
+                range_params['lower'] = edges[i-1]
+            if i < len(edges):
+                range_params['upper'] = edges[i]
+            stmt = self.get_select_statement(tablename, incremental, lower=i > 0, upper=i < len(edges))
+            ranges.append((stmt, range_params))
+
+        logger.info('Reading table {} in {} partitions'.format(tablename, len(ranges)))
+
+        # the watermark advances per range only if ranges are in watermark order
+        advance_per_range = self.partition_ordered and uppercase(self.partition_column) == uppercase(self.watermark_column or '')
+        max_wm = None
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.partitions) as pool:
+                futures = [pool.submit(self.run_query, stmt, params=range_params) for stmt, range_params in ranges]
+                for future in (futures if self.partition_ordered else as_completed(futures)):
+                    df = future.result()
+                    yield df
+
+                    if self.watermark_column and len(df.index) > 0:
+                        # rows of a range are in watermark order
+                        wm = self.get_row_watermark(df)
+                        max_wm = wm if max_wm is None else max(max_wm, wm)
+                        if advance_per_range:
+                            self.advance_watermark(tablename, max_wm)
+                            self.commit_watermarks(tablename)
+
+            if max_wm is not None:
+                self.advance_watermark(tablename, max_wm)
+                self.commit_watermarks(tablename)
+        except Exception as e:
+            logger.error('Failed to read table "{}" due to error {}'.format(tablename, e))
+            raise SourceDataError('Failed to read table "{}"'.format(tablename))
+
+
+    '''
+        Function that returns the boundaries splitting a table into partitions,
+        interpolated between the min and max of the partition column or taken
+        from its quantiles (used for non numeric/date columns too).
+
+        Params:
+            tablename: name of the table
+            incremental: if rows are selected from after the watermark
+            params: bind parameters of the table select
+
+        Returns:
+            ascending list of the upper (inclusive) bound of each partition but the last
+    '''
+    def get_partition_edges(self, tablename, incremental, params):
+        pc = column(sql_name(self.partition_column))
+        n = self.partitions
+
+        if self.partition_method == 'minmax':
+            stmt = sql_select([func.min(pc).label('lo'), func.max(pc).label('hi')])
+            df = self.run_query(self.restrict_to_table(stmt, tablename, incremental), params=params)
+            lo = df.iloc[0]['LO']
+            hi = df.iloc[0]['HI']
+            if pd.isnull(lo) or pd.isnull(hi):
+                return []
+            if pd.api.types.is_number(lo) and pd.api.types.is_number(hi):
+                edges = [lo + (hi - lo) * i / n for i in range(1, n)]
+                if pd.api.types.is_integer(lo):
+                    edges = [int(e) for e in edges]
+                else:
+                    edges = [float(e) for e in edges]
+            elif isinstance(lo, (pd.Timestamp, datetime)):
+                lo = pd.Timestamp(lo)
+                hi = pd.Timestamp(hi)
+                edges = [(lo + (hi - lo) * i / n).to_pydatetime() for i in range(1, n)]
+            else:
+                logger.info('Partition column "{}" is not numeric or date, using quantiles'.format(self.partition_column))
+                return self.get_partition_quantiles(tablename, incremental, params)
+        else:
+            return self.get_partition_quantiles(tablename, incremental, params)
+
+        return sorted(set(edges))
+
+
+    '''
+        Function that returns the upper bound of each ntile of the partition column
+
+        Params:
+            tablename: name of the table
+            incremental: if rows are selected from after the watermark
+            params: bind parameters of the table select
+
+        Returns:
+            ascending list of the upper bound of each partition but the last
+    '''
+    def get_partition_quantiles(self, tablename, incremental, params):
+        pc = column(sql_name(self.partition_column))
+        buckets = sql_select([pc.label('pc'), func.ntile(self.partitions).over(order_by=pc).label('bucket')])
+        buckets = self.restrict_to_table(buckets, tablename, incremental).alias('buckets')
+        stmt = sql_select([func.max(buckets.c.pc).label('edge')]).group_by(buckets.c.bucket).order_by(text('edge'))
+        edges = [native_value(e) for e in self.run_query(stmt, params=params)['EDGE'] if pd.notnull(e)]
+        return sorted(set(edges))[:-1]
+
+
+    '''
+        Function that selects a statement from a table, after the watermark if incremental
+
+        Params:
+            stmt: sqlalchemy select
+            tablename: name of the table
+            incremental: if rows are selected from after the watermark
+
+        Returns:
+            sqlalchemy select
+    '''
+    def restrict_to_table(self, stmt, tablename, incremental):
+        stmt = stmt.select_from(self.get_table_clause(tablename))
+        if incremental:
+            stmt = stmt.where(self.get_watermark_condition())
+        return stmt
+
+
+    '''
+        Function that installs the change capture triggers of a table, if not
+        installed yet. On the first read of a table its changes are captured
+        from the current changelog sequence, and the table is read in full.
+
+        Params:
+            tablename: name of the table
+
+        Returns:
+            changelog sequence to read changes from, None if the table is to be read in full
+    '''
+    def start_change_capture(self, tablename):
+        if tablename not in self.captured_tables:
+            keys = self.get_primary_key(tablename)
+            with self.db_engine.begin() as conn:
+                if not self.has_change_capture(conn, tablename):
+                    logger.info('Installing change capture triggers on table {}'.format(tablename))
+                    for ddl in self.get_change_capture_ddl(tablename, keys):
+                        conn.execute(text(ddl))
+            self.captured_tables.add(tablename)
+
+        seq = self.watermarks.get(tablename, None)
+        if seq is None:
+            # changes made while the table is read are read again next cycle
+            stmt = sql_select([func.max(column('seq')).label('seq')]).select_from(table(sql_name(self.changelog_table)))
+            seq = self.run_query(stmt).iloc[0]['SEQ']
+            self.advance_watermark(tablename, 0 if pd.isnull(seq) else seq)
+            return None
+        return seq
+
+
+    '''
+        Function that returns a dataframe generator of the rows of a table
+        changed since a changelog sequence. Keys whose last change is a
+        delete are deleted rows, returned by get_deleted_rows once the changes
+        are read. Updates log the old key as deleted before the new key, so
+        rows whose key is updated are deleted under their old key.
+
+        Params:
+            tablename: name of the table
+            seq: changelog sequence to read changes from
+
+        Returns:
+            generator of dataframes
+    '''
+    def read_changes(self, tablename, seq):
+        keys = self.get_primary_key(tablename)
+        changelog = sql_select([column('seq'), column('pk'), column('op')]).select_from(table(sql_name(self.changelog_table))) \
+                        .where(and_(column('tablename') == bindparam('tablename'), column('seq') > bindparam('seq'))) \
+                        .order_by(column('seq')).limit(self.changelog_batch_size)
+
+        # deleted keys, keyed on their logged json
+        deleted = self.deleted_rows.setdefault(tablename, {})
+        try:
+            while True:
+                log = self.run_query(changelog, params={'tablename': tablename, 'seq': native_value(seq)})
+                if len(log.index) == 0:
+                    break
+                seq = log.iloc[-1]['SEQ']
+
+                # last change of each key, in sequence order
+                changed = {}
+                for pk, op in zip(log['PK'], log['OP']):
+                    values = json.loads(pk)
+                    values = tuple(values[k] for k in keys)
+                    key = json.dumps(values)
+                    changed.pop(key, None)
+                    changed[key] = (op, values)
+
+                upserted = []
+                for key, (op, values) in changed.items():
+                    if op == 'D':
+                        deleted[key] = values
+                    else:
+                        deleted.pop(key, None)
+                        upserted.append(values)
+
+                for pos in range(0, len(upserted), 500):
+                    stmt = self.get_select_statement(tablename).where(
+                                or_(*[and_(*[column(sql_name(k)) == v for k, v in zip(keys, values)]) for values in upserted[pos:pos+500]]))
+                    df = self.run_query(stmt)
+                    if len(df.index) > 0:
+                        yield df
+
+            self.advance_watermark(tablename, seq)
+        except Exception as e:
+            logger.error('Failed to read changes of table "{}" due to error {}'.format(tablename, e))
+            raise SourceDataError('Failed to read table "{}"'.format(tablename))
+
+
+    '''
+        Function that returns the keys of the rows deleted from a table, since
+        its changes were last read
+
+        Params:
+            tablename: name of the table
+
+        Returns:
+            dataframe of the primary key columns of deleted rows, None if there are none
+    '''
+    def get_deleted_rows(self, tablename):
+        deleted = self.deleted_rows.pop(tablename, None)
+        if not deleted:
+            return None
+        return pd.DataFrame(list(deleted.values()), columns=[uppercase(k) for k in self.get_primary_key(tablename)])
+
+
+    '''
+        Function that returns the primary key of a table, PrimaryKey if specified
+
+        Params:
+            tablename: name of the table
+
+        Returns:
+            list of key columns
+    '''
+    def get_primary_key(self, tablename):
+        if self.primary_key:
+            return self.primary_key
+        if tablename not in self.primary_keys:
+            schema, _, name = tablename.rpartition('.')
+            keys = inspect(self.db_engine).get_pk_constraint(name, schema=schema or None)['constrained_columns']
+            if not keys:
+                raise ValueError('Table "{}" has no primary key, PrimaryKey must be specified'.format(tablename))
+            self.primary_keys[tablename] = keys
+        return self.primary_keys[tablename]
+
+
+    '''
+        Function that returns the names of the change capture triggers of a table
+
+        Params:
+            tablename: name of the table
+
+        Returns:
+            dict of trigger names keyed on the INSERT, UPDATE and DELETE events
+    '''
+    def get_trigger_names(self, tablename):
+        return {e: 'twiddle_{}_{}'.format(tablename.replace('.', '_'), e.lower()) for e in ('INSERT', 'UPDATE', 'DELETE')}
+
+
+    '''
+        Function that checks if the change capture triggers of a table are installed
+
+        Params:
+            conn: database connection
+            tablename: name of the table
+
+        Returns:
+            True if the triggers are installed
+    '''
+    def has_change_capture(self, conn, tablename):
+        return False
+
+
+    '''
+        Function that returns the statements creating the changelog table and
+        the change capture triggers of a table
+
+        Params:
+            tablename: name of the table
+            keys: primary key columns
+
+        Returns:
+            list of ddl statements
+    '''
+    def get_change_capture_ddl(self, tablename, keys):
+        raise NotImplementedError('Function "get_change_capture_ddl" has not been implemented')
+
+
+    '''
+        Function that returns the columns to select from a table, TableColumns
+        if specified, otherwise the table columns referenced by the mapper.
+        The watermark columns and, with change capture, the primary key are always included.
+
+        Params:
+            tablename: name of the table
+
+        Returns:
+            list of columns, None to select all columns
+    '''
+    def get_select_columns(self, tablename):
+        if self.select_columns:
+            columns = self.select_columns[:]
+        else:
+            fields = self.get_source_fields()
+            if fields is None:
+                return None
+            # db column headers are compared in upper case, as they are read
+            fields = set(uppercase(f) for f in fields)
+            columns = [c for c in self.get_table_columns(tablename) if uppercase(c) in fields]
+            if not columns:
+                return None
+
+        required = list(self.watermark_columns)
+        if self.change_capture:
+            required += self.get_primary_key(tablename)
+        for r in required:
+            if uppercase(r) not in [uppercase(c) for c in columns]:
+                columns.append(r)
+        return columns
+
+
+    '''
+        Function that returns the column names of a table
+
+        Params:
+            tablename: name of the table, optionally prefixed by the schema
+
+        Returns:
+            list of column names
+    '''
+    def get_table_columns(self, tablename):
+        if tablename not in self.table_columns:
+            self.table_columns[tablename] = self.query_table_columns(tablename)
+            self.table_columns_time[tablename] = time.monotonic()
+        return self.table_columns[tablename]
+
+    '''
+        Function that queries the column names of a table
+
+        Params:
+            tablename: name of the table, optionally prefixed by the schema
+
+        Returns:
+            list of column names
+    '''
+    def query_table_columns(self, tablename):
+        schema, _, name = tablename.rpartition('.')
+        return [c['name'] for c in inspect(self.db_engine).get_columns(name, schema=schema or None)]
+
+    '''
+        Function that drops the cached columns and statements of a table once
+        they are older than TableListTTL seconds, as the table may have been
+        altered. Tables read through metadata are never listed, so the
+        table list refresh does not expire them.
+
+        Params:
+            tablename: name of the table
+    '''
+    def expire_table_columns(self, tablename):
+        cached = self.table_columns_time.get(tablename, None)
+        if cached is None or time.monotonic() - cached < self.table_list_ttl:
+            return
+        self.table_columns.pop(tablename, None)
+        del self.table_columns_time[tablename]
+        for key in [k for k in self.statements if k[0] == tablename]:
+            del self.statements[key]
+
+
+    '''
+        Function that returns the table clause of a table, its name is not quoted
+
+        Params:
+            tablename: name of the table, optionally prefixed by the schema
+
+        Returns:
+            sqlalchemy table clause
+    '''
+    def get_table_clause(self, tablename):
+        return table(sql_name(tablename))
+
+
     '''
         Function that returns a dataframe for from a sql query
         Params:
             q: sql query
+            chunksize: if specified, a generator of dataframes of chunksize rows is returned
+            params: bind parameters of the query
     '''
-    def run_query(self, q):
+    def run_query(self, q, chunksize=None, params=None):
+        if chunksize is not None:
+            return self.run_query_in_chunks(q, chunksize, params=params)
+
         try:
-            df =  pd.read_sql_query(q, self.db_engine)
+            df =  pd.read_sql_query(q, self.db_engine, params=params or None)
             # convert db column headers to uppper case
             df.columns = [uppercase(col) for col in df.columns]
             return df
@@ -132,6 +899,29 @@ class DsDatabaseBase(DsBase):
             raise e
 
 
+    '''
+        Function that returns a dataframe generator for a sql query. Rows are
+        fetched from a server-side (unbuffered) cursor where the database driver
+        supports it, so the result set is never held in memory as a whole.
+
+        Params:
+            q: sql query
+            chunksize: number of rows per dataframe
+            params: bind parameters of the query
+    '''
+    def run_query_in_chunks(self, q, chunksize, params=None):
+        try:
+            with self.db_engine.connect() as conn:
+                conn = conn.execution_options(stream_results=True)
+                for df in pd.read_sql_query(q, conn, chunksize=chunksize, params=params or None):
+                    # convert db column headers to uppper case
+                    df.columns = [uppercase(col) for col in df.columns]
+                    yield df
+        except Exception as e:
+            logger.warning('Failed to run sql query "{}"'.format(q))
+            raise e
+
+
     '''
         Function that is essentially alias of get_table_list()
     '''
@@ -139,24 +929,83 @@ class DsDatabaseBase(DsBase):
         return self.get_table_list()
 
     '''
-        Function that list of tables
+        Function that returns the list of tables matching the table pattern.
+        The list is cached for up to TableListTTL seconds, and listed again
+        sooner if the catalog version changed, where the database provides one.
+
+        Returns:
+            list of table names
     '''
     def get_table_list(self):
+        now = time.monotonic()
+        version = self.get_catalog_version()
+        if self.table_list is not None and now - self.table_list_time < self.table_list_ttl:
+            if version is None or version == self.catalog_version:
+                return self.table_list
+
+        if self.table_pattern and self.table_regex is None:
+            try:
+                self.table_regex = re.compile(self.table_pattern)
+            except re.error as e:
+                logger.error('Invalid TablePattern "{}": {}'.format(self.table_pattern, e))
+                raise ValueError('Invalid TablePattern "{}"'.format(self.table_pattern))
+
+        self.table_list = [t for t in self.query_table_names() if self.table_regex is None or self.table_regex.match(t)]
+        if self.change_capture:
+            self.table_list = [t for t in self.table_list if t.lower() != self.changelog_table.lower()]
+        self.table_list_time = now
+        self.catalog_version = version
+
+        # table definitions may have changed
+        self.table_columns.clear()
+        self.table_columns_time.clear()
+        self.statements.clear()
+        return self.table_list
+
+    '''
+        Function that queries the names of the tables of the database
+
+        Returns:
+            list of table names
+    '''
+    def query_table_names(self):
         return []
 
+    '''
+        Function that returns a cheap indicator of changes to the catalog
+
+        Returns:
+            value that changes when tables are created or dropped, None if not supported
+    '''
+    def get_catalog_version(self):
+        return None
+
 
     '''
-        Function placeholder for archiving data source
+        Function that commits the watermark of a table once its rows have
+        been committed to the repository, or discards it if they failed
 
         Params:
             tablename: table to archive
-            done: if the file has been successfully processed.
+            done: if the table has been successfully processed.
 
         Returns:
             None
     '''
     def archive_data(self, tablename, done=True):
-        self.persist_watermarks()
+        if not done:
+            self.pending_watermarks.pop(tablename, None)
+            self.deleted_rows.pop(tablename, None)
+            return
+
+        seq = self.pending_watermarks.get(tablename, None)
+        self.commit_watermarks(tablename)
+
+        # changes read and committed are no longer needed
+        if self.change_capture and seq is not None:
+            with self.db_engine.begin() as conn:
+                conn.execute(text('DELETE FROM {} WHERE tablename = :tablename AND seq <= :seq'.format(self.changelog_table)),
+                             {'tablename': tablename, 'seq': seq})
 
     '''
         Function to return label for the data source
@@ -165,12 +1014,45 @@ class DsDatabaseBase(DsBase):
         return ''
          
     '''
-        Function that persists watermarks to fs
+        Function that records the watermark of rows read from a table, to be
+        committed once the rows are committed to the repository
+
+        Params:
+            tablename: name of the table
+            watermark: watermark column value of the last row read, a tuple for a composite watermark
+    '''
+    def advance_watermark(self, tablename, watermark):
+        if isinstance(watermark, tuple):
+            self.pending_watermarks[tablename] = tuple(native_value(v) for v in watermark)
+        else:
+            self.pending_watermarks[tablename] = native_value(watermark)
+
+    '''
+        Function that commits pending watermarks, persisting them in a single transaction
+
+        Params:
+            tablename: table to commit the watermark of, default is every table
+    '''
+    def commit_watermarks(self, tablename=None):
+        if tablename is None:
+            watermarks = self.pending_watermarks
+            self.pending_watermarks = {}
+        elif tablename in self.pending_watermarks:
+            watermarks = {tablename: self.pending_watermarks.pop(tablename)}
+        else:
+            return
+
+        self.watermarks.update(watermarks)
+        if self.watermark_store is not None:
+            self.watermark_store.save(watermarks)
+
+    '''
+        Function to close the watermark store
     '''
-    def persist_watermarks(self):
-        if self.watermark_store:
-            with open(self.watermark_store, 'wb') as wmstore:
-                pickle.dump(self.watermarks, wmstore)
+    def close(self):
+        if self.watermark_store is not None:
+            self.watermark_store.close()
+            self.watermark_store = None
 
     
     
@@ -178,6 +1060,9 @@ class DsDatabaseBase(DsBase):
     Class for reading MySQL data sources and convert into pandas dataframe.
 '''
 class DsDatabaseMysql(DsDatabaseBase):
+
+    supports_change_capture = True
+
     def __init__(self, config):
         super().__init__('database.mysql', config)
 
@@ -186,23 +1071,67 @@ class DsDatabaseMysql(DsDatabaseBase):
         else:
             dburl = 'mysql+pymysql://{s}/{d}'.format(s=self.db_server, d=self.db_name)
 
-        self.db_engine = create_engine(dburl)
+        self.db_engine = get_engine(dburl, **self.engine_options)
 
 
     '''
-        Function that list of tables based on the table pattern
+        Function that queries the names of the tables of the database
     '''
-    def get_table_list(self):
+    def query_table_names(self):
         q = '''
              SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = "{d}"
             '''.format(d=self.db_name)
 
-        df = self.run_query(q)
-        if self.table_pattern:
-            return [t for t in list(df['TABLE_NAME']) if re.match(self.table_pattern, t)]
-        else:
-            return list(df['TABLE_NAME'])
+        return list(self.run_query(q)['TABLE_NAME'])
+
+    '''
+        Function that returns the number and latest creation time of the tables
+    '''
+    def get_catalog_version(self):
+        q = '''
+             SELECT COUNT(*) AS N, MAX(CREATE_TIME) AS T FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = "{d}"
+            '''.format(d=self.db_name)
+
+        return tuple(self.run_query(q).iloc[0])
             
+    '''
+        Function that checks if the change capture triggers of a table are installed
+    '''
+    def has_change_capture(self, conn, tablename):
+        q = '''
+             SELECT COUNT(*) FROM INFORMATION_SCHEMA.TRIGGERS
+             WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME IN :triggers
+            '''
+        stmt = text(q).bindparams(bindparam('triggers', expanding=True))
+        return conn.execute(stmt, {'triggers': list(self.get_trigger_names(tablename).values())}).scalar() == 3
+
+    '''
+        Function that returns the statements creating the changelog table and
+        the change capture triggers of a table
+    '''
+    def get_change_capture_ddl(self, tablename, keys):
+        log = self.changelog_table
+        ddl = ['''
+            CREATE TABLE IF NOT EXISTS {log} (
+                seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+                tablename VARCHAR(255) NOT NULL,
+                pk TEXT NOT NULL,
+                op CHAR(1) NOT NULL,
+                changed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX {log}_tablename_seq (tablename, seq)
+            )'''.format(log=log)]
+
+        for event, rows in change_capture_events:
+            inserts = ' '.join("INSERT INTO {log} (tablename, pk, op) VALUES ('{t}', JSON_OBJECT({pk}), '{op}');".format(
+                            log=log, t=tablename, op=op, pk=', '.join("'{k}', {r}.{k}".format(k=k, r=r) for k in keys)) for r, op in rows)
+            # DDL is not transactional, triggers left by a failed install are replaced
+            name = self.get_trigger_names(tablename)[event]
+            ddl.append('DROP TRIGGER IF EXISTS {n}'.format(n=name))
+            ddl.append('''
+                CREATE TRIGGER {n} AFTER {e} ON {t} FOR EACH ROW
+                BEGIN {i} END'''.format(n=name, t=tablename, e=event, i=inserts))
+        return ddl
+
     '''
         Function to return label for the data source
     '''
@@ -220,21 +1149,19 @@ class DsDatabaseOracle(DsDatabaseBase):
         else:
             dburl = 'oracle+cx_oracle://{s}/{d}'.format(s=self.db_server, d=self.db_name)
 
-        self.db_engine = create_engine(dburl)
+        # rows fetched per round-trip by cx_Oracle
+        self.db_engine = get_engine(dburl, arraysize=int(config[self.ds_config_section]['ArraySize']), **self.engine_options)
 
     '''
-        Function that list of tables based on the table pattern
+        Function that queries the names of the tables of the database. Oracle
+        has no cheap catalog version, the list is refreshed every TableListTTL.
     '''
-    def get_table_list(self):
+    def query_table_names(self):
         q = '''
              SELECT TABLE_NAME FROM ALL_TABLES
             '''
 
-        df = self.run_query(q)
-        if self.table_pattern:
-            return [t for t in list(df['TABLE_NAME']) if re.match(self.table_pattern, t)]
-        else:
-            return list(df['TABLE_NAME'])
+        return list(self.run_query(q)['TABLE_NAME'])
 
     '''
         Function to return label for the data source
@@ -252,23 +1179,29 @@ class DsDatabaseMssql(DsDatabaseBase):
         if self.db_username is not None and self.db_password is not None:
             dburl = 'mssql+pymssql://{u}:{p}@{s}/{d}'.format(s=self.db_server, d=self.db_name, u=self.db_username, p=self.db_password)
         else:
-            dburl = 'msgsql+pymssql://{s}/{d}'.format(s=self.db_server, d=self.db_name)
+            dburl = 'mssql+pymssql://{s}/{d}'.format(s=self.db_server, d=self.db_name)
 
-        self.db_engine = create_engine(dburl)
+        self.db_engine = get_engine(dburl, **self.engine_options)
 
     '''
-        Function that list of tables based on the table pattern
+        Function that queries the names of the tables of the database
     '''
-    def get_table_list(self):
+    def query_table_names(self):
         q = '''
              SELECT TABLE_NAME FROM {d}.INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE' order by TABLE_NAME
             '''.format(d=self.db_name)
 
-        df = self.run_query(q)
-        if self.table_pattern:
-            return [t for t in list(df['TABLE_NAME']) if re.match(self.table_pattern, t)]
-        else:
-            return list(df['TABLE_NAME'])
+        return list(self.run_query(q)['TABLE_NAME'])
+
+    '''
+        Function that returns the number and latest modification time of the tables
+    '''
+    def get_catalog_version(self):
+        q = '''
+             SELECT COUNT(*) AS N, MAX(modify_date) AS T FROM {d}.sys.tables
+            '''.format(d=self.db_name)
+
+        return tuple(self.run_query(q).iloc[0])
 
     '''
         Function to return label for the data source
@@ -277,29 +1210,430 @@ class DsDatabaseMssql(DsDatabaseBase):
         return 'MsSQL table'
          
 
+class DsDatabasePostgres(DsDatabaseBase):
+
+    def __init__(self, config):
+        super().__init__('database.postgres', config)
+
+        if not has_psycopg2:
+            raise ValueError('psycopg2 must be installed to read Postgres tables')
+
+        if self.db_username is not None and self.db_password is not None:
+            dburl = 'postgresql+psycopg2://{u}:{p}@{s}/{d}'.format(s=self.db_server, d=self.db_name, u=self.db_username, p=self.db_password)
+        else:
+            dburl = 'postgresql+psycopg2://{s}/{d}'.format(s=self.db_server, d=self.db_name)
+
+        self.db_engine = get_engine(dburl, **self.engine_options)
+
+    '''
+        Function that queries the names of the tables of the current schema
+    '''
+    def query_table_names(self):
+        q = '''
+             SELECT table_name FROM information_schema.tables
+             WHERE table_schema = current_schema() AND table_type = 'BASE TABLE' ORDER BY table_name
+            '''
+
+        return list(self.run_query(q)['TABLE_NAME'])
+
+    '''
+        Function that returns the number and latest object id of the tables of
+        the current schema, a new object id is assigned to each created table
+    '''
+    def get_catalog_version(self):
+        q = '''
+             SELECT COUNT(*) AS n, MAX(c.oid::bigint) AS m FROM pg_class c
+             JOIN pg_namespace ns ON ns.oid = c.relnamespace
+             WHERE c.relkind IN ('r', 'p') AND ns.nspname = current_schema()
+            '''
+
+        return tuple(self.run_query(q).iloc[0])
+
+    '''
+        Function that returns the table clause of a table, the table and schema
+        names are quoted as table names are listed in their actual case
+    '''
+    def get_table_clause(self, tablename):
+        schema, _, name = tablename.rpartition('.')
+        clause = table(quoted_name(name, True))
+        if schema:
+            # table() only takes a schema from SQLAlchemy 1.3.18
+            clause.schema = quoted_name(schema, True)
+        return clause
+
+    '''
+        Function that returns a dataframe for a sql query. Table selects are
+        exported with COPY ... TO STDOUT WITH CSV and parsed by the csv parser,
+        other (catalog) queries are run through pandas.
+
+        Params:
+            q: sql query
+            chunksize: if specified, a generator of dataframes of chunksize rows is returned
+            params: bind parameters of the query
+    '''
+    def run_query(self, q, chunksize=None, params=None):
+        if isinstance(q, str):
+            return super().run_query(q, chunksize=chunksize, params=params)
+
+        if chunksize is not None:
+            return self.copy_query(q, chunksize, params=params)
+        df, = self.copy_query(q, None, params=params)
+        return df
+
+    '''
+        Function that returns a dataframe generator for a sql statement. The
+        statement is exported with COPY by a thread writing to a pipe, read
+        concurrently by the csv parser, so rows are never converted to tuples.
+
+        Params:
+            q: sqlalchemy statement
+            chunksize: number of rows per dataframe, None for a single dataframe
+            params: bind parameters of the statement
+    '''
+    def copy_query(self, q, chunksize, params=None):
+        conn = self.db_engine.raw_connection()
+        try:
+            compiled = q.compile(dialect=self.db_engine.dialect)
+            values = dict(compiled.params)
+            values.update(params or {})
+            # values are rendered as literals by psycopg2, COPY does not take parameters
+            with conn.cursor() as cursor:
+                sql = cursor.mogrify(str(compiled), values).decode(pg_encodings[conn.encoding])
+        except Exception as e:
+            conn.close()
+            logger.warning('Failed to run sql query "{}"'.format(q))
+            raise e
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT * FROM ({}) AS q LIMIT 0'.format(sql))
+                column_types = [(uppercase(d[0]), d[1]) for d in cursor.description]
+        except Exception as e:
+            conn.close()
+            logger.warning('Failed to run sql query "{}"'.format(q))
+            raise e
+
+        # nulls are written as \N so they are told apart from empty strings
+        copy_sql = "COPY ({}) TO STDOUT WITH CSV HEADER NULL '\\N'".format(sql)
+        read_fd, write_fd = os.pipe()
+        errors = []
+
+        def export():
+            try:
+                with os.fdopen(write_fd, 'wb') as pipe_out, conn.cursor() as cursor:
+                    cursor.copy_expert(copy_sql, pipe_out)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=export, daemon=True)
+        thread.start()
+
+        pipe_in = os.fdopen(read_fd, 'rb')
+        try:
+            # values are read as text and converted by column type, as the csv
+            # parser would infer types per chunk and drop leading zeros
+            csv_options = {'dtype': str, 'keep_default_na': False, 'na_values': ['\\N']}
+            if chunksize is None:
+                dfs = [pd.read_csv(pipe_in, **csv_options)]
+            else:
+                dfs = pd.read_csv(pipe_in, chunksize=chunksize, **csv_options)
+            for df in dfs:
+                # convert db column headers to uppper case
+                df.columns = [uppercase(col) for col in df.columns]
+                yield DsDatabasePostgres.convert_columns(df, column_types)
+        except Exception as e:
+            # an export error closes the pipe early, it is the error to report
+            pipe_in.close()
+            thread.join()
+            logger.warning('Failed to run sql query "{}"'.format(copy_sql))
+            raise errors[0] if errors else e
+        finally:
+            # closing the pipe stops an export the reader has given up on
+            pipe_in.close()
+            thread.join()
+            if errors:
+                conn.invalidate()
+            else:
+                conn.rollback()
+            conn.close()
+
+        if errors:
+            logger.warning('Failed to run sql query "{}"'.format(copy_sql))
+            raise errors[0]
+
+    '''
+        Function that converts the text columns of a COPY export to the types
+        the query results would have through the database driver
+
+        Params:
+            df: dataframe of text columns
+            column_types: list of (column name, postgres type oid)
+
+        Returns:
+            dataframe
+    '''
+    @classmethod
+    def convert_columns(cls, df, column_types):
+        for name, oid in column_types:
+            values = df[name]
+            if oid in pg_int_types:
+                if values.isnull().any():
+                    # nullable ints would become floats and lose precision
+                    values = pd.Series([int(v) if isinstance(v, str) else None for v in values], index=df.index, dtype='Int64')
+                else:
+                    values = values.astype('int64')
+            elif oid in pg_float_types:
+                values = values.astype('float64')
+            elif oid == pg_numeric_type:
+                values = values.map(lambda v: Decimal(v) if isinstance(v, str) else v)
+            elif oid == pg_bool_type:
+                values = values.map({'t': True, 'f': False})
+            elif oid in pg_datetime_types:
+                values = pd.to_datetime(values)
+            else:
+                continue
+            df[name] = values
+        return df
+
+    '''
+        Function to return label for the data source
+    '''
+    def get_label(self):
+        return 'Postgres table'
+
+
 class DsDatabaseSqlite(DsDatabaseBase):
+
+    supports_change_capture = True
     
     def __init__(self, config):
         super().__init__('database.sqlite', config)
 
-        self.db_path = config[self.ds_config_section]['DbPath']
+        ds_config = config[self.ds_config_section]
+
+        self.db_path = ds_config['DbPath']
         dburl = 'sqlite:///{d}'.format(d=self.db_path)
 
-        self.db_engine = create_engine(dburl)
+        self.db_engine = get_engine(dburl, **self.engine_options)
+
+        # the native engine reads with the sqlite3 module over read-only
+        # connections, one per concurrent query, straight into numpy columns
+        self.engine = ds_config['Engine'].lower()
+        if self.engine not in ('sqlalchemy', 'native'):
+            raise ValueError('Unrecognised sqlite Engine "{}"'.format(ds_config['Engine']))
+        self.fetch_size = int(ds_config['FetchSize'])
+        self.native_conns = []
+        self.native_conns_lock = threading.Lock()
+
+        # databases attached to the native connections, as alias=path
+        self.attach_databases = [a.split('=', 1) for a in ds_config['AttachDatabases'].split()]
+        if self.attach_databases and self.engine != 'native':
+            raise ValueError('AttachDatabases requires the native sqlite Engine')
+
+        # tables without a watermark are partitioned on their rowid
+        if self.partitions > 1 and not self.partition_column:
+            self.partition_column = 'rowid'
 
     '''
-        Function that list of tables based on the table pattern
+        Function that queries the names of the tables of the database, and
+        of the attached databases prefixed by their alias
     '''
-    def get_table_list(self):
+    def query_table_names(self):
         q = '''
-             SELECT name FROM sqlite_master WHERE type='table'
+             SELECT name FROM {s}sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\'
             '''
 
-        df = self.run_query(q)
-        if self.table_pattern:
-            return [t for t in list(df['NAME']) if re.match(self.table_pattern, t)]
+        names = list(self.run_query(q.format(s=''))['NAME'])
+        for alias, _ in self.attach_databases:
+            names += ['{}.{}'.format(alias, n) for n in self.run_query(q.format(s=alias + '.'))['NAME']]
+        return names
+
+    '''
+        Function that queries the column names of a table, read with PRAGMA
+        table_info for the native engine, which attached databases require
+    '''
+    def query_table_columns(self, tablename):
+        if self.engine != 'native':
+            return super().query_table_columns(tablename)
+
+        schema, _, name = tablename.rpartition('.')
+        q = "PRAGMA {s}table_info('{t}')".format(s=schema + '.' if schema else '', t=name)
+        return list(self.run_query(q)['NAME'])
+
+    '''
+        Function that returns a dataframe for a sql query, read with the sqlite3
+        module for the native engine
+
+        Params:
+            q: sql query
+            chunksize: if specified, a generator of dataframes of chunksize rows is returned
+            params: bind parameters of the query
+    '''
+    def run_query(self, q, chunksize=None, params=None):
+        if self.engine != 'native':
+            return super().run_query(q, chunksize=chunksize, params=params)
+
+        if chunksize is not None:
+            return self.fetch_query(q, chunksize, params=params)
+        df, = self.fetch_query(q, None, params=params)
+        return df
+
+    '''
+        Function that returns a dataframe generator for a sql query, rows are
+        fetched in batches of FetchSize rows and converted to numpy columns
+
+        Params:
+            q: sql query or sqlalchemy statement
+            chunksize: number of rows per dataframe, None for a single dataframe
+            params: bind parameters of the query
+    '''
+    def fetch_query(self, q, chunksize, params=None):
+        if isinstance(q, str):
+            sql = q
+            values = params or {}
         else:
-            return list(df['NAME'])
+            compiled = q.compile(dialect=self.db_engine.dialect)
+            values = dict(compiled.params)
+            values.update(params or {})
+            sql = str(compiled)
+            if compiled.positiontup is not None:
+                values = [values[k] for k in compiled.positiontup]
+
+        conn = self.get_native_connection()
+        try:
+            cursor = conn.execute(sql, values)
+        except Exception as e:
+            self.release_native_connection(conn)
+            logger.warning('Failed to run sql query "{}"'.format(sql))
+            raise e
+
+        try:
+            names = [uppercase(d[0]) for d in cursor.description] if cursor.description else []
+            size = chunksize or self.fetch_size
+            while True:
+                columns = [[] for _ in names]
+                nrows = 0
+                while chunksize is None or nrows < chunksize:
+                    rows = cursor.fetchmany(size)
+                    if not rows:
+                        break
+                    nrows += len(rows)
+                    for i, values in enumerate(zip(*rows)):
+                        columns[i].append(self.values_to_array(values))
+
+                if nrows == 0 and chunksize is not None:
+                    break
+                yield pd.DataFrame({n: (np.concatenate(c) if c else np.array([], dtype=object)) for n, c in zip(names, columns)},
+                                   columns=names)
+                if chunksize is None:
+                    break
+        finally:
+            cursor.close()
+            self.release_native_connection(conn)
+
+    '''
+        Class function to convert the values of a column to a numpy array,
+        typed when the values are all integers or floats. Integer columns
+        with nulls become float, as they are read by pandas.
+
+        Params:
+            values: tuple of column values
+
+        Returns:
+            numpy array
+    '''
+    @classmethod
+    def values_to_array(cls, values):
+        first = next((v for v in values if v is not None), None)
+        try:
+            if isinstance(first, int) and None not in values:
+                return np.array(values, dtype=np.int64)
+            if isinstance(first, (int, float)):
+                return np.array(values, dtype=np.float64)
+        except (TypeError, ValueError, OverflowError):
+            # sqlite columns may hold values of any type
+            pass
+        return np.array(values, dtype=object)
+
+    '''
+        Function that returns an idle read-only native connection, opened with
+        the attached databases if there is none
+
+        Returns:
+            sqlite3 connection
+    '''
+    def get_native_connection(self):
+        with self.native_conns_lock:
+            if self.native_conns:
+                return self.native_conns.pop()
+
+        conn = sqlite3.connect('file:{}?mode=ro'.format(quote(os.path.abspath(self.db_path))), uri=True, check_same_thread=False)
+        for alias, path in self.attach_databases:
+            conn.execute('ATTACH DATABASE ? AS {}'.format(alias), ('file:{}?mode=ro'.format(quote(os.path.abspath(path))),))
+        return conn
+
+    '''
+        Function to return a native connection to the idle connections
+
+        Params:
+            conn: sqlite3 connection
+    '''
+    def release_native_connection(self, conn):
+        with self.native_conns_lock:
+            self.native_conns.append(conn)
+
+    '''
+        Function to close the native connections and the watermark store
+    '''
+    def close(self):
+        with self.native_conns_lock:
+            for conn in self.native_conns:
+                conn.close()
+            self.native_conns = []
+        super().close()
+
+    '''
+        Function that returns the schema versions, incremented on every schema change
+    '''
+    def get_catalog_version(self):
+        schemas = [''] + [alias + '.' for alias, _ in self.attach_databases]
+        return tuple(int(self.run_query('PRAGMA {}schema_version'.format(s)).iloc[0, 0]) for s in schemas)
+
+    '''
+        Function that checks if the change capture triggers of a table are installed
+    '''
+    def has_change_capture(self, conn, tablename):
+        q = '''
+             SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN :triggers
+            '''
+        stmt = text(q).bindparams(bindparam('triggers', expanding=True))
+        return conn.execute(stmt, {'triggers': list(self.get_trigger_names(tablename).values())}).scalar() == 3
+
+    '''
+        Function that returns the statements creating the changelog table and
+        the change capture triggers of a table
+    '''
+    def get_change_capture_ddl(self, tablename, keys):
+        log = self.changelog_table
+        ddl = ['''
+            CREATE TABLE IF NOT EXISTS {log} (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                tablename TEXT NOT NULL,
+                pk TEXT NOT NULL,
+                op TEXT NOT NULL,
+                changed TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )'''.format(log=log),
+            'CREATE INDEX IF NOT EXISTS {log}_tablename_seq ON {log} (tablename, seq)'.format(log=log)]
+
+        for event, rows in change_capture_events:
+            inserts = ' '.join("INSERT INTO {log} (tablename, pk, op) VALUES ('{t}', json_object({pk}), '{op}');".format(
+                            log=log, t=tablename, op=op, pk=', '.join("'{k}', {r}.{k}".format(k=k, r=r) for k in keys)) for r, op in rows)
+            name = self.get_trigger_names(tablename)[event]
+            ddl.append('DROP TRIGGER IF EXISTS {n}'.format(n=name))
+            ddl.append('''
+                CREATE TRIGGER {n} AFTER {e} ON {t}
+                BEGIN {i} END'''.format(n=name, t=tablename, e=event, i=inserts))
+        return ddl
 
     '''
         Function to return label for the data source
@@ -0,0 +1,273 @@
+import io
+import os
+import errno
+import shutil
+import gzip
+import bz2
+import lzma
+import queue
+import tarfile
+import zipfile
+import threading
+from fnmatch import fnmatch
+
+try:
+    import zstandard
+    has_zstandard = True
+except ImportError:
+    has_zstandard = False
+
+try:
+    from isal import igzip_threaded
+    has_isal = True
+except ImportError:
+    has_isal = False
+
+
+# separator between the container path and the member name of a data unit
+container_separator = '::'
+
+
+'''
+    Class wrapping a (decompressing) stream so that blocks are read ahead
+    in a background thread, decompression then runs concurrently with the
+    parsing of the data already read. zlib, bz2, lzma and zstd all release
+    the GIL while decompressing.
+'''
+class ReadAheadReader(io.RawIOBase):
+
+    def __init__(self, stream, block_size=4*1024*1024, depth=4):
+        super().__init__()
+        self.stream = stream
+        self.block_size = block_size
+        self.blocks = queue.Queue(depth)
+        self.buffer = b''
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.read_ahead, daemon=True)
+        self.thread.start()
+
+    '''
+        Function run by the background thread to fill the block queue
+    '''
+    def read_ahead(self):
+        try:
+            while True:
+                block = self.stream.read(self.block_size)
+                if not self.put(block) or not block:
+                    break
+        except Exception as e:
+            self.put(e)
+
+    '''
+        Function to queue a block, gives up if the reader has been closed
+
+        Returns:
+            True if the block is queued
+    '''
+    def put(self, block):
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(block, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer and not self.eof:
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self.eof = True
+            else:
+                self.buffer = memoryview(block)
+
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.stream.close()
+        super().close()
+
+
+'''
+    Function to open a file for reading, decompressing it based on its extension.
+    Gzip uses the multi-threaded isal reader when installed, other compressions
+    are decompressed in a read ahead thread.
+
+    Params:
+        path: path of the file
+        threads: number of decompression threads, if supported
+
+    Returns:
+        binary file object
+'''
+def open_compressed(path, threads=1):
+    lpath = path.lower()
+    if lpath.endswith(('.gz', '.tgz')):
+        if has_isal:
+            return igzip_threaded.open(path, 'rb', threads=threads)
+        stream = gzip.open(path, 'rb')
+    elif lpath.endswith(('.zst', '.tzst')):
+        if not has_zstandard:
+            raise ValueError('zstandard must be installed to read "{}"'.format(path))
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    elif lpath.endswith(('.bz2', '.tbz2')):
+        stream = bz2.open(path, 'rb')
+    elif lpath.endswith(('.xz', '.txz')):
+        stream = lzma.open(path, 'rb')
+    else:
+        return open(path, 'rb')
+
+    return io.BufferedReader(ReadAheadReader(stream))
+
+
+# file extension added to archived files keyed on archive compression
+compression_suffixes = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+'''
+    Function to move a file, copying it if the destination is on another device.
+    Files are copied to a temporary file first so that the destination is never
+    left partially written.
+
+    Params:
+        source_path: file to move
+        dest_path: destination of the file
+'''
+def move_file(source_path, dest_path):
+    try:
+        os.rename(source_path, dest_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise e
+        tmp_path = dest_path + '.tmp'
+        shutil.copy2(source_path, tmp_path)
+        os.rename(tmp_path, dest_path)
+        os.remove(source_path)
+
+
+'''
+    Function to compress a file to a destination and remove the source file.
+    Files already compressed, by their extension, are moved as they are.
+
+    Params:
+        source_path: file to compress
+        dest_path: destination of the file, the compression extension is appended
+        compression: one of 'gzip', 'zstd', None for no compression
+
+    Returns:
+        path of the compressed file
+'''
+def compress_file(source_path, dest_path, compression=None):
+    if compression is None or source_path.lower().endswith(('.gz', '.tgz', '.zip', '.zst', '.tzst', '.bz2', '.xz', '.txz')):
+        move_file(source_path, dest_path)
+        return dest_path
+
+    dest_path += compression_suffixes[compression]
+    tmp_path = dest_path + '.tmp'
+    with open(source_path, 'rb') as src:
+        if compression == 'gzip':
+            with gzip.open(tmp_path, 'wb', compresslevel=6) as dest:
+                shutil.copyfileobj(src, dest, 1024*1024)
+        else:
+            with open(tmp_path, 'wb') as fh, zstandard.ZstdCompressor(threads=-1).stream_writer(fh) as dest:
+                shutil.copyfileobj(src, dest, 1024*1024)
+    os.rename(tmp_path, dest_path)
+    os.remove(source_path)
+    return dest_path
+
+
+'''
+    Class for reading the members of a zip or (compressed) tar file
+    without extracting them.
+
+    Zip members are read directly. Tar members are read from a single
+    forward pass over the stream, which is kept open between members
+    so members read in listing order decompress the container only once.
+'''
+class FileContainer:
+
+    def __init__(self, path, threads=1):
+        self.path = path
+        self.threads = threads
+        self.is_zip = path.lower().endswith('.zip')
+        self.tar = None
+        self.tar_stream = None
+
+        # members yet to be archived and if any of them failed
+        self.pending = set()
+        self.failed = False
+
+    '''
+        Function that lists the files in the container matching a pattern
+
+        Params:
+            pattern: file pattern, matched on the base name of the members
+
+        Returns:
+            list of member names
+    '''
+    def list_members(self, pattern):
+        if self.is_zip:
+            with zipfile.ZipFile(self.path) as zf:
+                names = [info.filename for info in zf.infolist() if not info.is_dir()]
+        else:
+            with open_compressed(self.path, self.threads) as stream, tarfile.open(fileobj=stream, mode='r|') as tf:
+                names = [member.name for member in tf if member.isfile()]
+
+        return [n for n in names if fnmatch(os.path.basename(n), pattern)]
+
+    '''
+        Function to open a member of the container for reading
+
+        Params:
+            member: name of the member
+
+        Returns:
+            binary file object
+    '''
+    def open_member(self, member):
+        if self.is_zip:
+            zf = zipfile.ZipFile(self.path)
+            try:
+                stream = zf.open(member)
+            finally:
+                # the member stream keeps its own reference to the file
+                zf.close()
+            return stream
+
+        # tar streams can only move forward, reopen if the member has been passed
+        for _ in range(2):
+            if self.tar is None:
+                self.tar_stream = open_compressed(self.path, self.threads)
+                self.tar = tarfile.open(fileobj=self.tar_stream, mode='r|')
+            tinfo = self.tar.next()
+            while tinfo is not None:
+                if tinfo.name == member:
+                    # tar stream members are not seekable, but claim to be
+                    return io.BufferedReader(ReadAheadReader(self.tar.extractfile(tinfo)))
+                tinfo = self.tar.next()
+            self.close()
+
+        raise KeyError('Member "{}" not found in "{}"'.format(member, self.path))
+
+    '''
+        Function to close the container
+    '''
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar_stream.close()
+            self.tar = None
+            self.tar_stream = None
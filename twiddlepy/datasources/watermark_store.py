@@ -0,0 +1,109 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from twiddlepy.utils import logger
+
+
+# header of sqlite database files, watermark stores without it are legacy pickles
+sqlite_header = b'SQLite format 3\x00'
+
+
+'''
+    Class for persisting the high watermarks of datasources in a sqlite
+    database, in WAL mode so that workers sharing the store read while one
+    of them writes. Watermarks are stored one row per datasource and table,
+    and updates are written in a single transaction, so a crash never leaves
+    a partially written store.
+'''
+class WatermarkStore:
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.lock = threading.Lock()
+
+        legacy = self.read_legacy_store()
+
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS watermarks (
+                source TEXT NOT NULL,
+                tablename TEXT NOT NULL,
+                watermark BLOB,
+                updated REAL,
+                PRIMARY KEY (source, tablename)
+            )''')
+
+        if legacy:
+            logger.info('Migrating watermark store "{}" to sqlite'.format(path))
+            self.save(legacy)
+
+    '''
+        Function that moves a legacy pickle store aside, so that the sqlite
+        store is created in its place
+
+        Returns:
+            dict of watermarks keyed on table name, None if the store is not a pickle
+    '''
+    def read_legacy_store(self):
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+            return None
+
+        with open(self.path, 'rb') as store:
+            if store.read(len(sqlite_header)) == sqlite_header:
+                return None
+            store.seek(0)
+            watermarks = pickle.load(store)
+
+        os.rename(self.path, self.path + '.pickle')
+        return watermarks
+
+    '''
+        Function that loads the watermarks of the datasource
+
+        Returns:
+            dict of watermarks keyed on table name
+    '''
+    def load(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT tablename, watermark FROM watermarks WHERE source = ?', (self.source,)).fetchall()
+        return {tablename: pickle.loads(watermark) for tablename, watermark in rows}
+
+    '''
+        Function that saves watermarks in a single transaction
+
+        Params:
+            watermarks: dict of watermarks keyed on table name
+    '''
+    def save(self, watermarks):
+        if not watermarks:
+            return
+        now = time.time()
+        rows = [(self.source, t, pickle.dumps(w), now) for t, w in watermarks.items()]
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.executemany('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)', rows)
+                self.conn.execute('COMMIT')
+            except Exception as e:
+                self.conn.execute('ROLLBACK')
+                raise e
+
+    '''
+        Function that removes the watermarks of the datasource
+    '''
+    def reset(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM watermarks WHERE source = ?', (self.source,))
+
+    '''
+        Function to close the store
+    '''
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 
-import os, sys, time
+import os, sys
 from collections import OrderedDict
+from collections.abc import Iterator
 
 from .config import config
 from .ds_manager import DatasourceManager
 from .repo_manager import RepositoryManager
 from .mapper import Mapper
+from .flatten import FlattenPlan, flatten_df
 
 from .utils import logger
 from .exceptions import TwiddleException, ExectionError
@@ -40,6 +42,10 @@ except ImportError as e:
     source_header_tidier_func = None
 
 
+# columns datasources add to identify the data unit rows are read from
+source_unit_columns = ('filename', 'tablename', 'sheetname')
+
+
 class TwiddleDriver:
     def __init__(self, config):
         self.config = config
@@ -47,8 +53,11 @@ class TwiddleDriver:
         self.mapper = Mapper(config['Mapper'])
 
         self.datasource = DatasourceManager(config).get_datasource()
+        self.datasource.set_mapper(self.mapper)
 
         self.repository = RepositoryManager(config).get_repository()
+        # nested source field extraction plans, keyed on dataset
+        self.flatten_plans = {}
         self.should_build_repository_schema = self.repository.should_build_schema
 
         if config['Processing']['WaitForData'] == '' or config['Processing']['WaitForData'].lower() == 'true':
@@ -79,42 +88,20 @@ class TwiddleDriver:
 
             for dunit in data_units:
                 try:
-                    df = self.datasource.read_data_to_df(dunit, dtype='str')
-                    if premap_transformation_function is not None:
-                        try:
-                            df = premap_transformation_function(df)
-                        except Exception as e:
-                            logger.error('Failed to execute transformation function "{}" due to error {}'.format(premap_transformation_function.__name__, e))
-                            raise ExectionError('Failed to execute metadata processor "{}"'.format(premap_transformation_function.__name__))
-
-                    df = df.astype(source_field_type)
-
-                    if len(df) > 0:
+                    dfs = self.datasource.read_data_to_df(dunit, dtype='str')
+                    # datasources either return a dataframe (or dict of dataframes)
+                    # or a generator of them, read in chunks
+                    if not isinstance(dfs, Iterator):
+                        dfs = [dfs]
+
+                    for df in dfs:
+                        if self.process_chunk(df, dunit, source_field_type, source_to_repo_mapping):
+                            waiting = False
+
+                    deleted = self.datasource.get_deleted_rows(dunit)
+                    if deleted is not None and len(deleted) > 0:
+                        self.delete_rows(deleted, dunit, source_to_repo_mapping)
                         waiting = False
-                        logger.info('Processing {} "{}"...'.format(self.datasource.get_label(), dunit))
-
-                    if not isinstance(df, OrderedDict):
-                        qa_schema, qa_fields = self.mapper.get_validation_schema()
-                        if transformation_function is not None:
-                            df = self.process_dataframe(df, qa_schema, qa_fields, source_to_repo_mapping, transformation_function)
-                        else:
-                            df = self.process_dataframe(df, qa_schema, qa_fields, source_to_repo_mapping)
-                        self.repository.commit_df_in_chunks(df)
-                    else:
-                        dfs = {}
-                        for _, (sheet_name, sheet_df) in enumerate(df.items()):
-                            qa_schema, qa_fields = self.mapper.get_validation_schema(dataset=sheet_name)
-                            if isinstance(transformation_function, dict) and sheet_name in transformation_function:
-                                trans = transformation_function[sheet_name]
-                            else:
-                                trans = None
-                            dfs[sheet_name] = self.process_dataframe(sheet_df, qa_schema, qa_fields, source_to_repo_mapping, transformation_function)
-                
-                        if excel_cross_sheet_proc is not None:
-                            dfs = excel_cross_sheet_proc(dfs)
-
-                        for name, df in dfs.items():
-                            self.repository.commit_df_in_chunks(df)
 
                     self.datasource.archive_data(dunit)
                 except TwiddleException as e:
@@ -125,12 +112,106 @@ class TwiddleDriver:
                 
             
             if not self.wait_for_data:
+                self.datasource.close()
                 break
             
             if not waiting:
                 logger.info('Waiting for more source data to process...')
                 waiting = True
-            time.sleep(10)
+            self.datasource.wait_for_data(10)
+
+    '''
+        Function to process and commit a dataframe, or dict of dataframes, read from a data unit
+
+        Params:
+            df: dataframe or dict of dataframes keyed on sheet name
+            dunit: the data unit the dataframe was read from
+            source_field_type: source field type keyed on source field name
+            source_to_repo_mapping: dict of source_field_name to repository_field_name
+
+        Returns:
+            True if the dataframe contains any rows
+    '''
+    def process_chunk(self, df, dunit, source_field_type, source_to_repo_mapping):
+        if premap_transformation_function is not None:
+            try:
+                df = premap_transformation_function(df)
+            except Exception as e:
+                logger.error('Failed to execute transformation function "{}" due to error {}'.format(premap_transformation_function.__name__, e))
+                raise ExectionError('Failed to execute metadata processor "{}"'.format(premap_transformation_function.__name__))
+
+        df = flatten_df(df, self.get_flatten_plan)
+
+        if isinstance(df, OrderedDict):
+            # sheets only contain the columns of their own dataset
+            df = OrderedDict((name, sheet_df.astype({c: t for c, t in source_field_type.items() if c in sheet_df.columns}))
+                        for name, sheet_df in df.items())
+            has_rows = any(len(sheet_df) > 0 for sheet_df in df.values())
+        else:
+            df = df.astype(source_field_type)
+            has_rows = len(df) > 0
+        if has_rows:
+            logger.info('Processing {} "{}"...'.format(self.datasource.get_label(), dunit))
+
+        if not isinstance(df, OrderedDict):
+            qa_schema, qa_fields = self.mapper.get_validation_schema()
+            if transformation_function is not None:
+                df = self.process_dataframe(df, qa_schema, qa_fields, source_to_repo_mapping, transformation_function)
+            else:
+                df = self.process_dataframe(df, qa_schema, qa_fields, source_to_repo_mapping)
+            self.repository.commit_df_in_chunks(df)
+        else:
+            dfs = {}
+            for _, (sheet_name, sheet_df) in enumerate(df.items()):
+                qa_schema, qa_fields = self.mapper.get_validation_schema(dataset=sheet_name)
+                if isinstance(transformation_function, dict) and sheet_name in transformation_function:
+                    trans = transformation_function[sheet_name]
+                else:
+                    trans = None
+                dfs[sheet_name] = self.process_dataframe(sheet_df, qa_schema, qa_fields, source_to_repo_mapping, transformation_function)
+    
+            if excel_cross_sheet_proc is not None:
+                dfs = excel_cross_sheet_proc(dfs)
+
+            for name, df in dfs.items():
+                self.repository.commit_df_in_chunks(df)
+
+        return has_rows
+
+
+    '''
+        Function to return the plan extracting the nested source fields of a
+        dataset, e.g. address.city or items[].sku, built once per dataset
+
+        Params:
+            dataset: dataset name, all datasets if None
+
+        Returns:
+            FlattenPlan object
+    '''
+    def get_flatten_plan(self, dataset=None):
+        if dataset not in self.flatten_plans:
+            self.flatten_plans[dataset] = FlattenPlan(self.mapper.get_source_field_names(dataset))
+        return self.flatten_plans[dataset]
+
+
+    '''
+        Function to delete rows deleted at the source from the repository
+
+        Params:
+            df: dataframe of the key columns of deleted rows
+            dunit: the data unit the rows were deleted from
+            source_to_repo_mapping: dict of source_field_name to repository_field_name
+    '''
+    def delete_rows(self, df, dunit, source_to_repo_mapping):
+        columns = [c for c in df.columns if c in source_to_repo_mapping]
+        if not columns:
+            logger.warning('Rows deleted from {} "{}" not deleted, key columns {} are not mapped'.format(self.datasource.get_label(), dunit, list(df.columns)))
+            return
+
+        logger.info('Deleting {} rows deleted from {} "{}"'.format(len(df), self.datasource.get_label(), dunit))
+        self.repository.delete_df(df[columns].rename(columns=source_to_repo_mapping))
+
 
     def process_dataframe(self, df, qa_schema, qa_fields, source_to_repo_mapping, transformation_function=None):
         if len(df) == 0:
@@ -142,6 +223,17 @@ class TwiddleDriver:
             df.columns = [source_header_tidier_func(col) for col in df.columns]
 
         df = self.mapper.convert_datetime_column(df)
+
+        # source columns the mapper does not reference are not sent on, the
+        # columns datasources add about the data unit are kept for transformations
+        if source_to_repo_mapping:
+            kept = set(source_to_repo_mapping)
+            kept.update(source_unit_columns)
+            kept.update(getattr(self.repository, 'extra_fields', None) or {})
+            unmapped = [c for c in df.columns if c not in kept]
+            if unmapped:
+                df = df.drop(columns=unmapped)
+
         df = df.rename(columns=source_to_repo_mapping)
         
         if transformation_function is not None:
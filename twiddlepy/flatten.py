@@ -0,0 +1,226 @@
+import re
+import numpy as np
+import pandas as pd
+
+from .utils import logger
+
+
+# a path step: a key, optionally followed by [n] to index an array or []
+# to explode it, e.g. items[0].sku or items[].sku
+path_step_pattern = re.compile(r'^([^\[\]]+)((?:\[\d*\])*)$')
+explode = None
+
+
+'''
+    Function to parse a dotted source field name into path steps
+
+    Params:
+        name: source field name, e.g. address.city, items[0].sku, items[].sku
+
+    Returns:
+        list of path steps, keys (str), array indices (int) or explode (None),
+        None if the name is not a path
+'''
+def parse_path(name):
+    steps = []
+    for part in name.split('.'):
+        match = path_step_pattern.match(part)
+        if match is None:
+            return None
+        steps.append(match.group(1))
+        for index in re.findall(r'\[(\d*)\]', match.group(2)):
+            steps.append(int(index) if index else explode)
+    return steps
+
+
+'''
+    Function to check if a source field name is a nested path
+
+    Params:
+        name: source field name
+
+    Returns:
+        True if the name contains path separators
+'''
+def is_path(name):
+    return '.' in name or '[' in name
+
+
+'''
+    Function that returns the projection of a list of source fields, as
+    accepted by mongo: array indices are removed, and paths under another
+    projected path are left out, as mongo rejects path collisions.
+
+    Params:
+        fields: source field names
+
+    Returns:
+        dict of projected paths
+'''
+def get_projection(fields):
+    paths = sorted(set(re.sub(r'\[\d*\]', '', f) for f in fields))
+    projection = {}
+    for path in paths:
+        if not any(path.startswith(p + '.') for p in projection):
+            projection[path] = 1
+    return projection
+
+
+'''
+    Function to apply a path step to a list of values
+
+    Params:
+        values: list of values
+        step: key or array index
+
+    Returns:
+        list of the values at the step, None where absent
+'''
+def apply_step(values, step):
+    if isinstance(step, int):
+        return [v[step] if isinstance(v, list) and len(v) > step else None for v in values]
+    return [v.get(step) if isinstance(v, dict) else None for v in values]
+
+
+'''
+    Class for extracting nested source fields from object columns of
+    documents (dicts and lists), e.g. read from Mongo or JSON. Each path
+    prefix is extracted once per dataframe for all the fields sharing it,
+    and at most one array can be exploded into a row per element.
+'''
+class FlattenPlan:
+
+    def __init__(self, fields):
+        self.names = set(fields)
+        self.fields = []
+        self.explode_prefix = None
+        for name in fields:
+            # names that are not paths, e.g. a csv header "Price [EUR]", are plain columns
+            steps = parse_path(name) if is_path(name) else None
+            if steps is None:
+                continue
+            if explode in steps:
+                prefix = tuple(steps[:steps.index(explode)])
+                if steps.count(explode) > 1 or self.explode_prefix not in (None, prefix):
+                    logger.warning('Only one array can be exploded, source field "{}" is read as a column'.format(name))
+                    continue
+                self.explode_prefix = prefix
+            self.fields.append((name, steps))
+
+    '''
+        Function that adds the nested fields to a dataframe, fields already
+        in the dataframe or whose root column is absent are left as they are
+
+        Params:
+            df: dataframe
+
+        Returns:
+            dataframe with the nested fields as columns
+    '''
+    def apply(self, df):
+        fields = [(name, steps) for name, steps in self.fields if name not in df.columns and steps[0] in df.columns]
+        if not fields or len(df) == 0:
+            return df
+
+        # values of each path prefix, extracted once
+        cache = {}
+        columns = {}
+        exploded = []
+        for name, steps in fields:
+            if explode in steps:
+                exploded.append((name, steps))
+            else:
+                columns[name] = self.extract_path(steps, df, cache)
+
+        if exploded:
+            df, columns = self.explode(df, columns, exploded, cache)
+
+        # root columns only read for their nested fields are dropped
+        roots = {steps[0] for _, steps in fields if steps[0] not in self.names}
+        df = df.drop(columns=list(roots))
+        for name, values in columns.items():
+            # object dtype, so missing values do not turn ints into floats
+            df[name] = pd.Series(values, index=df.index, dtype=object)
+        return df
+
+    '''
+        Function to extract the values of a path from the root column of a dataframe
+
+        Params:
+            steps: path steps
+            df: dataframe
+            cache: dict of extracted values keyed on path prefix
+
+        Returns:
+            list of values
+    '''
+    def extract_path(self, steps, df, cache):
+        steps = tuple(steps)
+        for i in range(len(steps), 0, -1):
+            if steps[:i] in cache:
+                break
+        else:
+            i = 1
+            cache[steps[:1]] = df[steps[0]].tolist()
+
+        values = cache[steps[:i]]
+        for j in range(i, len(steps)):
+            values = apply_step(values, steps[j])
+            cache[steps[:j+1]] = values
+        return values
+
+    '''
+        Function to explode the array of the explode prefix into a row per
+        element, repeating the other columns
+
+        Params:
+            df: dataframe
+            columns: dict of extracted values keyed on field name
+            exploded: list of (field name, path steps) under the exploded array
+            cache: dict of extracted values keyed on path prefix
+
+        Returns:
+            exploded dataframe and columns
+    '''
+    def explode(self, df, columns, exploded, cache):
+        arrays = self.extract_path(self.explode_prefix, df, cache)
+        # rows without elements are kept, with empty element fields
+        arrays = [a if isinstance(a, list) and a else [None] for a in arrays]
+        lengths = np.fromiter((len(a) for a in arrays), dtype=np.int64, count=len(arrays))
+        positions = np.repeat(np.arange(len(arrays)), lengths)
+        elements = [e for a in arrays for e in a]
+
+        df = df.iloc[positions].reset_index(drop=True)
+        columns = {name: [values[p] for p in positions] for name, values in columns.items()}
+
+        element_cache = {}
+        for name, steps in exploded:
+            rest = tuple(steps[steps.index(explode)+1:])
+            values = elements
+            for i in range(len(rest)):
+                if rest[:i+1] in element_cache:
+                    values = element_cache[rest[:i+1]]
+                else:
+                    values = apply_step(values, rest[i])
+                    element_cache[rest[:i+1]] = values
+            columns[name] = values
+
+        logger.debug('Exploded {} to {} rows'.format('.'.join(str(s) for s in self.explode_prefix), len(df)))
+        return df, columns
+
+
+'''
+    Function that flattens the nested fields of a dataframe, or of the
+    dataframes of a dict keyed on dataset name
+
+    Params:
+        df: dataframe or dict of dataframes
+        get_plan: function returning the FlattenPlan of a dataset name, None for a dataframe
+
+    Returns:
+        flattened dataframe or dict of dataframes
+'''
+def flatten_df(df, get_plan):
+    if isinstance(df, pd.DataFrame):
+        return get_plan(None).apply(df)
+    return df.__class__((name, get_plan(name).apply(sheet_df)) for name, sheet_df in df.items())
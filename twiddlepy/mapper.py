@@ -108,6 +108,19 @@ class Mapper:
         else:
             return Mapper.filter_mapper(self.mapper_df, dataset)
 
+    '''
+        Function to return the source field names of the mapper
+
+        Params:
+            dataset: dataset for which source field names are returned, all datasets if None
+
+        Returns:
+            list of source field names
+    '''
+    def get_source_field_names(self, dataset=None):
+        mdf = self.get_mapper(dataset)
+        return list(mdf['source_field_name'].dropna().unique())
+
     '''
         Function to return source field type keyed on source field name.
     '''
@@ -41,3 +41,12 @@ class RepositoryCsv:
     
     def commit_df_in_chunks(self, df, remove_nan=True):
         return self.commit_df(df, remove_nan=remove_nan)
+
+    '''
+        Function to delete rows, CSV files are only appended to so rows are not deleted.
+        Params:
+            df: dataframe of the key fields of the rows to delete
+    '''
+    def delete_df(self, df):
+        if len(df) > 0:
+            logger.warning('{} deleted rows not removed from CSV file "{}"'.format(len(df), self.file_path))
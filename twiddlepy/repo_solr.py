@@ -13,6 +13,9 @@ class RepositorySolr:
         else:
             self.chunksize = int(solr_config['ChunkSize'])
 
+        # clauses of a delete query, up to the maxBooleanClauses of Solr
+        self.max_clauses = int(solr_config['MaxBooleanClauses'])
+
         solr_type_file = os.path.abspath(os.path.join(os.path.realpath(os.path.realpath(__file__)), '../data', 'solr_fieldtype_defaults.csv'))
         self.fieldtypes = self.load_fieldtypes(solr_type_file)
 
@@ -131,6 +134,29 @@ class RepositorySolr:
             self.commit_df(df[pos:pos_end], remove_nan=remove_nan, commit=commit)
             logger.info('{} records of {} committed to Solr'.format(str(pos_end).rjust(10), sz_df))
 
+    '''
+        Function to delete the documents matching the rows of a Pandas dataframe from Solr,
+        in chunks of size chunksize. Each row is a clause per key field, chunks are
+        smaller if needed to keep a query within MaxBooleanClauses clauses.
+        Params:
+            df: dataframe of the key fields of the documents to delete
+            commit: if to apply Solr commit after update
+    '''
+    def delete_df(self, df, commit=True):
+        sz_df = len(df)
+
+        if sz_df == 0:
+            return
+
+        logger.info('Deleting {} records from Solr'.format(sz_df))
+
+        chunksize = max(1, min(self.chunksize, self.max_clauses // max(1, len(df.columns))))
+        for pos in range(0, sz_df, chunksize):
+            rows = df[pos:pos + chunksize].to_dict('records')
+            q = ' OR '.join('(' + ' AND '.join('{}:"{}"'.format(f, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                for f, v in r.items()) + ')' for r in rows)
+            self.delete(q=q, commit=commit)
+
     '''
         Function to interface solrconn search
 
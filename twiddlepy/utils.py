@@ -115,6 +115,47 @@ def generate_ids_using_cols(df, col_names, idcol='id', overwrite=False, hashing=
     return mdf
 
 
+'''
+    Function to return the value at a dotted path, e.g. "address.city", in a nested document
+
+    Params:
+        doc: document (dict)
+        path: tuple of keys, from splitting the dotted field name, int keys index arrays
+
+    Returns:
+        value at the path, None if the path does not exist
+'''
+def get_path_value(doc, path):
+    for key in path:
+        if isinstance(key, int):
+            doc = doc[key] if isinstance(doc, list) and len(doc) > key else None
+        else:
+            doc = doc.get(key, None) if isinstance(doc, dict) else None
+        if doc is None:
+            return None
+    return doc
+
+
+'''
+    Function to flatten a nested document into a dict keyed on dotted paths
+
+    Params:
+        doc: document (dict)
+        prefix: prefix for the keys of the document
+
+    Returns:
+        flattened document
+'''
+def flatten_document(doc, prefix=''):
+    flat = {}
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            flat.update(flatten_document(value, prefix + key + '.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
 lowercase = lambda x: x.lower()
 
 uppercase = lambda x: x.upper()
\ No newline at end of file